@@ -1,83 +1,270 @@
-from flask import Blueprint, render_template, request
+from flask import Blueprint, Response, render_template, request, stream_with_context
 import simulation.game
 from simulation.game import Game, Move, Tile
-from simulation.player import Player
+from simulation.player import Player, RandomPlayer
+from simulation.policy import GreedyPlayer
+from simulation.mcts import MCTSPlayer
+from simulation.endgame import EndgamePlayer
+from simulation import serialize
+from simulation import profiling as sim_profiling
+from backend.sessions import GameRegistry
+from backend.bots import BotScheduler, fallback_move
+from backend.store import SQLiteStore, WriteBehind, StoredGame
+from simulation.movelog import MoveLog
+import threading
+import logging
+import secrets
+import atexit
 import time
-import dataclasses
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import json
 
 debug = False
 simulation.game.debug = debug
+profiling = False  # Profile every game's phases, for the /metrics endpoint
 
 bp = Blueprint("basic CLI", __name__, url_prefix="/basic-cli")
+logger = logging.getLogger(__name__)
 
-games = []  # To be filled later
-GameResponse = namedtuple("GameResponse", ("stateText", "status", "statusType", "gameState"))
+DEFAULT_GAME = "default"  # The table clients play at when they don't name a game
+games = GameRegistry(max_games=256, ttl=60*60)
+GameResponse = namedtuple("GameResponse", ("stateText", "status", "statusType", "gameState", "gameStateDiff", "version", "stateTextDiff"))  # When the server still has the version the client sent, gameStateDiff and stateTextDiff (serialize.diff()s from it) replace gameState and stateText
+HISTORY = 16  # How many versions back clients can be sent a diff rather than the whole state
+HEARTBEAT = 15  # Seconds between keep-alive comments on an idle event stream; also how quickly a stream notices its game was evicted
+BOT_TIME = 2  # Seconds an MCTS bot thinks per move
+bots = BotScheduler(max_workers=4, timeout=3*BOT_TIME, processes=True)  # Searching in processes keeps bots from holding the GIL against requests
+BOTS = {  # Kinds of computer player a table can seat, each made as make(player_id, n_players)
+    "random": RandomPlayer,
+    "greedy": GreedyPlayer,
+    "mcts": lambda player_id, n_players: MCTSPlayer(player_id, n_players, time_limit=BOT_TIME),
+    "endgame": lambda player_id, n_players: EndgamePlayer(player_id, n_players, time_limit=BOT_TIME)
+}
 
-def create_game():
-    game = Game.new_game(2, False, random_seed=1)
-    p0 = CLIPlayer(0, 2)
-    p1 = CLIPlayer(1, 2)
-    return GameContainer(game, (p0, p1))
+STORE_RETENTION = 30*24*60*60  # Seconds a stored game is kept after its last change; None keeps them forever
+store = None  # Where games are kept between restarts; opened by open_store() when the blueprint is registered, and None keeps them in memory only
+
+def open_store(path, retention=STORE_RETENTION):  # Replaces the store with a WriteBehind over the SQLite file at path, or with none if path is None
+    global store
+    if store is not None: store.close()
+    store = None if path is None else WriteBehind(SQLiteStore(path), retention=retention)
+    if store is not None: atexit.register(store.close)
+
+@bp.record_once
+def _setup(state):  # Apps choose the store in their config: BASIC_CLI_STORE_PATH (unset or None for memory only) and BASIC_CLI_STORE_RETENTION
+    config = state.app.config
+    open_store(config.get("BASIC_CLI_STORE_PATH"), config.get("BASIC_CLI_STORE_RETENTION", STORE_RETENTION))
+
+def create_game(game_id, n_players=2, random_seed=1, seat_bots=None):  # seat_bots maps seats to kinds of BOTS; a random_seed of None picks one
+    if random_seed is None: random_seed = secrets.randbits(63)  # Games have to be replayable from their logs, so the seed is always known
+    return _make_container(game_id, MoveLog(n_players, False, random_seed), seat_bots or {}, set())
+
+def restore_game(game_id, record):  # Rebuilds a stored game by replaying its log
+    return _make_container(game_id, record.log, record.bots, record.seats)
+
+def _make_container(game_id, log, seat_bots, seats):
+    game = log.replay(engine=Game)
+    if profiling: game.enable_profiling()
+    players = [BOTS[seat_bots[i]](i, log.n_players) if i in seat_bots else CLIPlayer(i, log.n_players) for i in range(log.n_players)]
+    return GameContainer(game, players, bots, MoveLog(log.n_players, log.advanced, log.seed, log.moves), game_id, store, seat_bots, seats)
+
+@bp.route("/games", methods=("POST",))
+def new_game():
+    body = request.get_json(silent=True) or {}
+    n_players = int(body.get("nPlayers", 2))
+    if n_players not in simulation.game.SETTINGS.N_BATCHES: return {"error": f"Games are for {', '.join(str(n) for n in simulation.game.SETTINGS.N_BATCHES)} players."}, 400
+    seed = body.get("seed")
+    if seed is not None and not (isinstance(seed, int) and -2**63 <= seed < 2**63): return {"error": "Seeds are 64-bit integers."}, 400
+    seat_bots = {int(seat): kind for seat, kind in (body.get("bots") or {}).items()}  # {"1": "mcts"} seats a bot as Player 1
+    for seat, kind in seat_bots.items():
+        if kind not in BOTS: return {"error": f"There is no {kind} bot; there are {', '.join(BOTS)}."}, 400
+        if not 0 <= seat < n_players: return {"error": f"There is no seat {seat}."}, 400
+    game_id = games.create(lambda game_id: create_game(game_id, n_players, seed, seat_bots))
+    return {"game": game_id, "nPlayers": n_players, "bots": {str(seat): kind for seat, kind in seat_bots.items()}}
+
+@bp.route("/games/<game_id>/join", methods=("POST",))
+def join(game_id):
+    container = find_game(game_id)
+    if container is None: return {"error": f"There is no game {game_id}."}, 404
+    body = request.get_json(silent=True) or {}
+    player_id = body.get("player")
+    if player_id is not None:
+        player_id = int_field(body, "player")
+        if player_id is None: return {"error": "player must be a seat number."}, 400
+    with container.lock:
+        if container.closed: return {"error": f"Game {game_id} was just unloaded; try again.", "retry": True}, 409
+        seat = container.join(player_id)
+        if seat is not None: container.save()
+    if seat is None: return {"error": "That seat is not available." if player_id is not None else "This game is full."}, 409
+    player_id, token = seat
+    return {"game": game_id, "player": player_id, "token": token}  # /play wants the token with every move for this seat
 
 @bp.route("/play", methods=("GET", "POST"))
 def play():
-    if len(games) == 0: games.append(create_game())  # For now, we'll only work with one game instance
     body = request.get_json()
     if request.method == "GET":
         # Requesting the page
         return render_template("play.html", scriptname="script/basic-cli.js", stylename="css/basic-cli.css")
     elif request.method == "POST":
-        if body is not None:
+        if not isinstance(body, dict): return {"error": "Send a JSON object."}, 400
+        game_id = body.get("game") or DEFAULT_GAME
+        container = find_game(game_id)
+        if container is None: return {"error": f"There is no game {game_id}."}, 404
+        with container.lock:
             if "requestType" in body:
                 if body["requestType"] == "stateText":
-                    # Requesting game state
-                    if body["player"] is None:
-                        return GameResponse(stateText=timestamp()+"\nSet your player ID first!", status="Please select your Player ID above", statusType="error", gameState="{}")._asdict()
-                    else:
-                        clientPlayer = games[0].players[int(body["player"])]
-                        return GameResponse(stateText=timestamp()+"\n"+clientPlayer.state_text, status=clientPlayer.status_text, statusType=clientPlayer.status_type, gameState=clientPlayer.state_json)._asdict()
-        # Sending in a move
-        player_id = int(body["player"])
-        move = Move(player_id, Tile.from_symbol(body["tile"]), int(body["source"]), int(body["dest"]))
-        games[0].process_input(move)
-        return {"success": games[0].players[player_id].move_success}
+                    # Requesting game state; clients that already have the current version (sent as the version field or If-None-Match) just get told so, in the body as 304 is only for GET and HEAD
+                    if body.get("player") is not None:
+                        if player_field(body, container) is None: return {"error": f"There is no player {body['player']}."}, 400
+                        if body.get("version") == container.etag or request.if_none_match.contains(container.etag): return {"notModified": True, "version": container.etag}, {"ETag": f'"{container.etag}"'}
+                    return state_response(container, body.get("player"), body.get("version")), {"ETag": f'"{container.etag}"'}
+            # Sending in a move
+            move, error = move_field(body, container)
+            if move is None: return {"error": error}, 400
+            player_id = move.player_id
+            if not isinstance(container.players[player_id], CLIPlayer): return {"error": f"Player {player_id} is a bot."}, 409
+            if not container.may_play(player_id, body.get("token")): return {"error": f"Seat {player_id} was claimed through join; send its token."}, 403
+            if not container.process_input(move): return {"error": f"Game {game_id} was just unloaded; send the move again.", "retry": True}, 409
+            return {"success": container.players[player_id].move_success}
+
+@bp.route("/events", methods=("GET",))
+def events():  # A Server-Sent Events stream that pushes the player's state_response() whenever their game changes, instead of the client polling /play
+    game_id = request.args.get("game") or DEFAULT_GAME
+    container = find_game(game_id)
+    if container is None: return {"error": f"There is no game {game_id}."}, 404
+    player = request.args.get("player")
+    if player is not None and player_field(request.args, container) is None: return {"error": f"There is no player {player}."}, 400
+
+    def stream():
+        version = None
+        sent = None
+        while True:
+            with container.lock:
+                if version == container.version and not container.closed: container.changed.wait(HEARTBEAT)
+                if container.closed: return  # Left the registry, and any game under this ID now is another container; the client reconnects to whichever that is (or gets a 404)
+                payload = None
+                if version != container.version:
+                    version = container.version
+                    payload = state_response(container, player, sent)
+                    sent = payload["version"]
+            if payload is None:
+                yield ": heartbeat\n\n"
+            else:
+                yield f"id: {payload['version']}\ndata: {json.dumps(payload)}\n\n"
+    return Response(stream_with_context(stream()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@bp.route("/metrics", methods=("GET",))
+def metrics():  # Each profiled game's phase timings, as Prometheus text or, with ?format=json, JSON
+    profiles = [(game_id, container.game.profile) for game_id, container in games.items() if container.game.profile is not None]
+    if request.args.get("format") == "json":
+        return {game_id: profile.to_dict() for game_id, profile in profiles}
+    return Response(sim_profiling.to_prometheus([({"game": game_id}, profile) for game_id, profile in profiles]), mimetype="text/plain; version=0.0.4")
+
+def find_game(game_id):  # The live game, rebuilding it from the store if it isn't in memory (after a restart, or eviction)
+    container = games.get(game_id)
+    if container is not None: return container
+    record = None if store is None else store.load(game_id)
+    if record is not None: return games.get_or_create(game_id, lambda game_id: restore_game(game_id, record))
+    if game_id == DEFAULT_GAME: return games.get_or_create(DEFAULT_GAME, create_game)
+    return None
+
+def int_field(body, name):  # body[name] as an int, or None if it is missing or not a whole number (as a number or a string)
+    value = body.get(name)
+    if isinstance(value, int) and not isinstance(value, bool): return value
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit(): return int(value)
+    return None
+
+def player_field(body, container):  # body["player"] as a player ID of the game, or None
+    player_id = int_field(body, "player")
+    return player_id if player_id is not None and 0 <= player_id < len(container.players) else None
+
+def move_field(body, container):  # (the Move body describes, None), or (None, what is wrong with it); only its fields are checked here, and the game decides whether it is legal
+    player_id = player_field(body, container)
+    if player_id is None: return None, "player must be a player of this game."
+    tile = Tile.from_symbol(body["tile"]) if isinstance(body.get("tile"), str) else None
+    if tile is None: return None, "tile must be a tile symbol."
+    source_id, dest_id = int_field(body, "source"), int_field(body, "dest")
+    if source_id is None or not 0 <= source_id <= len(container.game.view.batches): return None, "source must be the bench (0) or a batch number."
+    if dest_id is None or not 0 <= dest_id <= simulation.game.SETTINGS.ROWS: return None, "dest must be the floor (0) or a stage number."
+    return Move(player_id, tile, source_id, dest_id), None
+
+def state_response(container, player, since=None):  # Call with container.lock held; since is the version the client already has, if any
+    if player is None:
+        return GameResponse(stateText=timestamp()+"\nSet your player ID first!", status="Please select your Player ID above", statusType="error", gameState="{}", gameStateDiff=None, version=None, stateTextDiff=None)._asdict()
+    clientPlayer = container.players[int(player)]
+    if not isinstance(clientPlayer, CLIPlayer): return GameResponse(stateText=timestamp()+f"\nPlayer {player} is a bot.", status="Please select another Player ID above", statusType="error", gameState="{}", gameStateDiff=None, version=None, stateTextDiff=None)._asdict()
+    diffs = container.diff_since(since)
+    if diffs is None:
+        return GameResponse(stateText=timestamp()+"\n"+clientPlayer.state_text, status=clientPlayer.status_text, statusType=clientPlayer.status_type,
+            gameState=clientPlayer.state_json, gameStateDiff=None, version=container.etag, stateTextDiff=None)._asdict()
+    state_diff, text_diff = diffs
+    return GameResponse(stateText=None, status=clientPlayer.status_text, statusType=clientPlayer.status_type,
+        gameState=None, gameStateDiff=state_diff, version=container.etag, stateTextDiff=text_diff+[[[0], timestamp()]])._asdict()
 
 def timestamp():
     return f"{time.asctime()} .{round((time.time()%1)*1000)}" if debug else time.strftime("Updated: %I:%M:%S %p")
     # str(["|", "/", "-", "\\"][round(time.time() % 4)])
     # time.strftime("Updated: %I:%M:%S %p")
 
+def game_over_lines(view):  # Who won, as shown to players once the game is over
+    if view is None or view.turn >= 0: return []
+    winners = view.winners
+    if len(winners) == 1: return ["Game over!", "Player "+str(winners[0])+" won!"]
+    winners_str = ["Player "+str(w) for w in winners]
+    winners_str[len(winners)-1] = "and "+winners_str[len(winners)-1]
+    return ["Game over!", "Tie between "+(" " if len(winners) == 2 else ", ").join(winners_str)+"!"]
+
+class Rendering:  # The text and JSON forms of one view, each built the first time it is asked for and shared by every player shown that view
+    def __init__(self, view):
+        self.view = view
+        self._text = None
+        self._lines = None
+        self._dict = None
+        self._json = None
+
+    @property
+    def text(self):
+        if self._text is None: self._text = str(self.view)
+        return self._text
+
+    @property
+    def state_text(self):  # text, and who won once the game is over; what CLIPlayers are shown below the timestamp
+        over = game_over_lines(self.view)
+        return self.text if len(over) == 0 else self.text+"\n\n"+"\n".join(over)
+
+    @property
+    def lines(self):  # state_text's lines, after an empty first line standing in for the timestamp, for serialize.diff()
+        if self._lines is None: self._lines = [""]+self.state_text.split("\n")
+        return self._lines
+
+    @property
+    def dict(self):
+        if self._dict is None: self._dict = serialize.to_dict(self.view)
+        return self._dict
+
+    @property
+    def json(self):
+        if self._json is None: self._json = json.dumps(self.dict, separators=(",", ":"))
+        return self._json
+
 class CLIPlayer(Player):
     def __init__(self, player_id, n_players):
         super().__init__(player_id, n_players)
         self._game_state = None
-        self._state_text = ""
-        self._state_json = ""
+        self._rendering = Rendering(None)
         self._next_move = None
         self._status_text = None
         self._status_type = "note"
         self._move_success = False
         
-    def update(self, view):
+    def update(self, view, rendering=None):  # Pass the same rendering of view to every player to share the work of rendering it
         self._game_state = view
-        self._state_text = str(view)
-        self._state_json = json.dumps(dataclasses.asdict(view), default = lambda x: x.value)
+        self._rendering = rendering if rendering is not None else Rendering(view)
         if view.turn == self.player_id:
             self._status_text = f"Your turn, Player {self.player_id}!"
             self._status_type = "prompt"
         elif view.turn < 0:
-            a = "Game over!"
-            winners = view.winners
-            if len(winners) == 1: b = "Player "+str(winners[0])+" won!"
-            else:
-                winners_str = ["Player "+str(w) for w in winners]
-                winners_str[len(winners)-1] = "and "+winners_str[len(winners)-1]
-                b = "Tie between "+(" " if len(winners) == 2 else ", ").join(winners_str)+"!"
-            self._status_text = a+" "+b
+            self._status_text = " ".join(game_over_lines(view))
             self._status_type = "prompt"
-            self._state_text += "\n\n"+a+"\n"+b
         else:
             self._status_text = f"It is Player {view.turn}'s turn."
             self._status_type = "note"
@@ -102,11 +289,11 @@ class CLIPlayer(Player):
     
     @property
     def state_text(self):
-        return self._state_text
+        return self._rendering.state_text
 
     @property
     def state_json(self):
-        return self._state_json
+        return self._rendering.json
     
     @property
     def status_text(self):
@@ -126,19 +313,126 @@ class CLIPlayer(Player):
         self._next_move = next_move
 
 class GameContainer:  # A replacement for simulation.controller that works better for this application
-    def __init__(self, game, players):
+    def __init__(self, game, players, bots=None, log=None, game_id=None, store=None, seat_bots=None, seats=()):  # bots is the BotScheduler that plays any players that aren't CLIPlayers; with a store, every change to log (the game's moves so far) or the seats is saved as game_id
         assert len(players) == game.view.n_players
         self.game = game
         self.players = players
+        self.bots = bots
+        self.log = log
+        self.game_id = game_id
+        self.store = store
+        self.seat_bots = seat_bots or {}  # Kinds of bot, for the store
+        self.bot_job = None  # The bot turn being waited on, if any
+        self.fallbacks = 0  # Bot turns played by fallback_move() because the bot timed out, failed or gave an invalid move
+        self.closed = False
         self.game_over = False
+        self.lock = threading.Lock()  # Held by whichever request is using this game
+        self.changed = threading.Condition(self.lock)  # Notified whenever version changes, for event streams
+        self.version = 0  # Bumped whenever anything players see may have changed
+        self.epoch = secrets.token_hex(4)  # Distinguishes this game's versions from those of an earlier game with the same ID
+        self.seats = {**dict(seats), **{i: None for i, player in enumerate(players) if not isinstance(player, CLIPlayer)}}  # Player IDs that have been claimed through the join endpoint (with the token it gave out) or are bots (with None)
+        self.rendering = None
+        self._history = OrderedDict()  # The last HISTORY versions' renderings, oldest first, for diffs
+        self._diffs = {}  # (state diff, text diff) to the current version, by the version they start from
+        self._update_players()
+        self._record_version()
+        self.save()
+        with self.lock:
+            self._schedule_bot()
+
+    def _update_players(self):  # Every player sees the same view, so it is built once and rendered at most once, when first requested
+        view = self.game.view
+        rendering = self.rendering = Rendering(view)
         for player in self.players:
-            player.update(self.game.view)
+            if isinstance(player, CLIPlayer): player.update(view, rendering)
+            else: player.update(view)
+
+    @property
+    def etag(self):  # The version as clients see it
+        return f"{self.epoch}-{self.version}"
+
+    def _record_version(self):
+        self._history[self.version] = self.rendering
+        while len(self._history) > HISTORY: self._history.popitem(last=False)
+        self._diffs.clear()
+
+    def diff_since(self, etag):  # serialize.diff()s from the state and the state text's lines at version etag to the current ones, or None if that version is unknown or too old
+        if etag is None: return None
+        epoch, _, version = etag.rpartition("-")
+        if epoch != self.epoch or not version.isdigit(): return None
+        version = int(version)
+        if version not in self._diffs:
+            old = self._history.get(version)
+            if old is None: return None
+            self._diffs[version] = ([], []) if old is self.rendering else (serialize.diff(old.dict, self.rendering.dict), serialize.diff(old.lines, self.rendering.lines))
+        return self._diffs[version]
+
+    def join(self, player_id=None):  # Claims a seat (the first free one if player_id is None); returns (the seat, the token that plays it), or None if it can't be had
+        if player_id is None:
+            player_id = next((i for i in range(len(self.players)) if i not in self.seats), None)
+            if player_id is None: return None
+        if player_id in self.seats or not 0 <= player_id < len(self.players): return None
+        token = self.seats[player_id] = secrets.token_urlsafe(16)
+        return player_id, token
+
+    def may_play(self, player_id, token):  # Seats nobody has joined are open to anyone, as at the default table; a joined seat only to whoever has its token
+        expected = self.seats.get(player_id)
+        return expected is None or (isinstance(token, str) and secrets.compare_digest(token, expected))
     
-    def process_input(self, move):
+    def process_input(self, move):  # Call with self.lock held; returns False, having done nothing, if the game has been closed
+        if self.closed: return False  # Evicted after the request found it; a container restored from the store may already be playing on, so this one must not save over it
         clientPlayer = self.players[move.player_id]
         clientPlayer.set_next_move(move)
         validated_move = clientPlayer.play(self.game.check)
         if validated_move is not None:
-            self.game.play(validated_move)
-            for player in self.players:
-                player.update(self.game.view)
\ No newline at end of file
+            self._play(validated_move)
+        self._publish()  # Even a rejected move changes the mover's status message
+        if validated_move is not None: self._schedule_bot()
+        return True
+
+    def _play(self, move):  # Call with self.lock held
+        self.game.play(move)
+        if self.log is not None:
+            self.log.append(move)
+            self.save()
+        self._update_players()
+
+    def save(self):  # Queues the game for the store; call with self.lock held, or before anyone else can see the game
+        if self.closed or self.store is None or self.log is None or self.game_id is None: return
+        log = MoveLog(self.log.n_players, self.log.advanced, self.log.seed, self.log.moves)  # A copy, as the store writes it later
+        self.store.save(self.game_id, StoredGame(log, dict(self.seat_bots), {seat: token for seat, token in self.seats.items() if seat not in self.seat_bots}))
+
+    def _publish(self):  # Call with self.lock held
+        self.version += 1
+        self._record_version()
+        self.changed.notify_all()
+
+    def _schedule_bot(self):  # Call with self.lock held; starts the next turn if it is a bot's
+        turn = self.game.turn
+        if self.closed or self.bots is None or turn < 0 or isinstance(self.players[turn], CLIPlayer): return
+        self.bot_job = self.bots.submit(self)
+
+    def bot_moved(self, job, move, bot):  # Called by the BotScheduler with the bot's move and the bot itself (a new copy if it ran in another process), or Nones if it timed out or failed
+        with self.lock:
+            if job is not self.bot_job or self.closed: return  # Superseded by a timeout, or the game was closed
+            job.cancel()
+            self.bot_job = None
+            view = self.game.view
+            if bot is not None: self.players[view.turn] = bot
+            if move is None or move.player_id != view.turn or not self.game.check(move)[0]:
+                if move is not None: logger.warning("Bot %s gave the invalid move %s", view.turn, move)
+                self.fallbacks += 1
+                move = fallback_move(view)
+            self._play(move)
+            self._publish()
+            self._schedule_bot()
+
+    def close(self):  # Stops waiting on bots and ends event streams; called when the game leaves the registry
+        self.closed = True
+        job = self.bot_job
+        if job is not None: job.cancel()
+        if self.lock.acquire(blocking=False):  # The registry may call this with its own lock held, so never wait for ours; streams that miss the notification see closed at their next heartbeat
+            try:
+                self.changed.notify_all()
+            finally:
+                self.lock.release()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import concurrent.futures
+import multiprocessing
+import threading
+import logging
+import random
+from simulation.game import Game, decode_move
+from simulation.policy import MoveEvaluator, greedy_policy
+
+# Computer players' turns run on a worker pool rather than in the request that submitted the move before them, so a long search holds up neither that request nor other tables.
+# When a bot answers, its move is played under the game's lock and published like any other (a new version, which wakes event streams).
+# A bot that hasn't answered within timeout seconds, or that fails, is replaced for that turn by a greedy move; its late answer is thrown away.
+# With processes=True each turn pickles the bot over to a worker process and back, so bots must be picklable, but their thinking doesn't compete with requests for the GIL,
+# and a bot that times out goes on thinking on its own copy rather than on the player its game still holds. Threads (the default) are only for cheap bots, like policy players.
+# Worker processes are spawned rather than forked, as the server already has threads (requests, timers, the store's writer) whose locks a fork could copy mid-use; so apps have to guard their startup with if __name__ == "__main__".
+# Failures and timeouts are logged, as are the fallback moves that replace them.
+
+logger = logging.getLogger(__name__)
+
+class BotJob:  # One pending bot turn; GameContainer.bot_job is the only one it will accept a move for
+    def __init__(self, future, timer):
+        self.future = future
+        self.timer = timer
+
+    def cancel(self):
+        self.timer.cancel()
+        self.future.cancel()  # Only stops turns that haven't started; a running one finishes and is ignored
+
+def _think(bot, view):  # Runs in a worker; checks moves against a private copy of the view rather than the live game
+    move = bot.play(Game(view).check)
+    return move, bot
+
+def fallback_move(view, rgen=random):  # A cheap move for a bot that ran out of time
+    return decode_move(greedy_policy(MoveEvaluator.from_state(view), rgen), view.turn)
+
+class BotScheduler:
+    def __init__(self, max_workers=4, timeout=10, processes=False):
+        self.timeout = timeout
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn")) if processes else concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._results = concurrent.futures.ThreadPoolExecutor(1)  # Hands finished turns back to their games outside whatever thread finished them, so no callback ever runs under a game's lock
+
+    def submit(self, container):  # Call with container.lock held when it is a bot's turn; returns the BotJob
+        view = container.game.view
+        bot = container.players[view.turn]
+        future = self._executor.submit(_think, bot, view)
+        timer = threading.Timer(self.timeout, lambda: self._hand_back(self._timed_out, container, job))
+        timer.daemon = True
+        job = BotJob(future, timer)
+        timer.start()
+        future.add_done_callback(lambda f: self._hand_back(self._finished, container, job, f))
+        return job
+
+    def _hand_back(self, fn, *args):
+        try:
+            self._results.submit(fn, *args)
+        except RuntimeError:  # Shut down, so there is nobody left to tell
+            pass
+
+    def _timed_out(self, container, job):
+        if job is container.bot_job: logger.warning("A bot took more than %s seconds to move", self.timeout)
+        container.bot_moved(job, None, None)
+
+    def _finished(self, container, job, future):
+        if future.cancelled(): return
+        try:
+            move, bot = future.result()
+        except Exception:  # A crashed bot gets the same fallback as a slow one
+            logger.exception("A bot failed to move")
+            move, bot = None, None
+        container.bot_moved(job, move, bot)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._results.shutdown(wait=False)
@@ -0,0 +1,86 @@
+import collections
+import threading
+import secrets
+import time
+
+class GameRegistry:  # Live games by ID. Games idle for longer than ttl seconds are evicted, as are the least recently used ones once there are more than max_games. Games that leave have their close() method called, if they have one
+    # max_games is a count of games, not a size in bytes, so the memory it allows is max_games times what a game takes (mostly its undo history and recent renderings)
+    # Factories run without the registry's lock held, as making a game can take a while (replaying it, say), and other games' lookups shouldn't wait for that
+    def __init__(self, max_games=256, ttl=60*60, clock=time.monotonic):
+        self.max_games = max_games
+        self.ttl = ttl
+        self._clock = clock
+        self._games = collections.OrderedDict()  # game_id -> [container, last access time], least recently used first
+        self._lock = threading.Lock()  # Guards the registry itself; each container has its own lock for playing
+        self._reserved = set()  # IDs that create() has picked but whose game is still being made
+
+    def create(self, factory, game_id=None):  # Adds factory(game_id) as a new game and returns its ID
+        with self._lock:
+            if game_id is None:
+                game_id = secrets.token_urlsafe(6)
+                while game_id in self._games or game_id in self._reserved: game_id = secrets.token_urlsafe(6)
+            elif game_id in self._games or game_id in self._reserved:
+                raise KeyError(f"Game {game_id} already exists.")
+            self._reserved.add(game_id)
+        try:
+            game = factory(game_id)
+        finally:
+            with self._lock: self._reserved.discard(game_id)
+        with self._lock:
+            self._games[game_id] = [game, self._clock()]
+            self._evict()
+        return game_id
+
+    def get(self, game_id):  # The game's container, or None if there is no such game (or it has been evicted)
+        with self._lock:
+            self._evict()
+            entry = self._games.get(game_id)
+            if entry is None: return None
+            entry[1] = self._clock()
+            self._games.move_to_end(game_id)
+            return entry[0]
+
+    def get_or_create(self, game_id, factory):  # factory(game_id) makes the game if it isn't there; if two requests make it at once, the first one in wins and the other's game is closed
+        game = self.get(game_id)
+        if game is not None: return game
+        game = factory(game_id)
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is None:
+                entry = self._games[game_id] = [game, self._clock()]
+                self._evict()
+            else:
+                entry[1] = self._clock()
+                self._games.move_to_end(game_id)
+        if entry[0] is not game: _close(game)
+        return entry[0]
+
+    def remove(self, game_id):
+        with self._lock:
+            entry = self._games.pop(game_id, None)
+        if entry is not None: _close(entry[0])
+
+    def ids(self):
+        with self._lock:
+            return list(self._games)
+
+    def items(self):  # (game_id, container) pairs, without counting as an access
+        with self._lock:
+            return [(game_id, entry[0]) for game_id, entry in self._games.items()]
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, game_id):
+        return game_id in self._games
+
+    def _evict(self):  # Must hold self._lock
+        cutoff = self._clock()-self.ttl
+        while len(self._games) > 0:
+            game_id, (_, last_access) = next(iter(self._games.items()))
+            if last_access >= cutoff and len(self._games) <= self.max_games: break
+            _close(self._games.pop(game_id)[0])
+
+def _close(game):  # Must not take the game's own lock, as it may be called with the registry's lock held
+    close = getattr(game, "close", None)
+    if close is not None: close()
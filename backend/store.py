@@ -0,0 +1,139 @@
+from simulation.movelog import MoveLog
+from collections import namedtuple
+import threading
+import logging
+import sqlite3
+import json
+import time
+
+# Durable storage for live games. A game is stored as just its move log (settings, seed and moves) and its seating, so saving one is small and rebuilding it is a replay.
+# GameStore is the interface; SQLiteStore is the local default. WriteBehind wraps any store so that saving only queues the record:
+# a background thread writes whatever has queued up in one transaction every interval seconds, so requests never wait on the disk.
+# A crash loses at most the last interval's moves. With a retention, the writer also forgets games that haven't changed in that many seconds, once at startup and every sweep_every seconds after.
+
+StoredGame = namedtuple("StoredGame", ("log", "bots", "seats"))  # bots maps seats to kinds of bot; seats maps those claimed through the join endpoint to their tokens
+
+class GameStore:
+    def save_many(self, records):  # records is a dict of game_id -> StoredGame
+        raise NotImplementedError
+
+    def load(self, game_id):  # The StoredGame, or None
+        raise NotImplementedError
+
+    def delete(self, game_id):
+        raise NotImplementedError
+
+    def delete_older(self, seconds):  # Forgets games that haven't changed in that long; returns how many
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def save(self, game_id, record):
+        self.save_many({game_id: record})
+
+class SQLiteStore(GameStore):
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()  # The connection is shared by the writer thread and whichever requests load games
+        with self._lock, self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS games (id TEXT PRIMARY KEY, log BLOB NOT NULL, bots TEXT NOT NULL, seats TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def save_many(self, records):
+        now = time.time()
+        rows = [(game_id, record.log.to_bytes(), json.dumps({str(seat): kind for seat, kind in record.bots.items()}), json.dumps({str(seat): token for seat, token in record.seats.items()}), now) for game_id, record in records.items()]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO games (id, log, bots, seats, updated) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def load(self, game_id):
+        with self._lock:
+            row = self._connection.execute("SELECT log, bots, seats FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None: return None
+        log, bots, seats = row
+        seats = json.loads(seats)
+        seats = seats.items() if isinstance(seats, dict) else [(seat, None) for seat in seats]  # Games stored before seats had tokens list just the seats, which stay claimed but need no token
+        return StoredGame(MoveLog.from_bytes(log), {int(seat): kind for seat, kind in json.loads(bots).items()}, {int(seat): token for seat, token in seats})
+
+    def delete(self, game_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM games WHERE id = ?", (game_id,))
+
+    def delete_older(self, seconds):
+        with self._lock, self._connection:
+            return self._connection.execute("DELETE FROM games WHERE updated < ?", (time.time()-seconds,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class WriteBehind(GameStore):
+    def __init__(self, store, interval=1.0, retention=None, sweep_every=60*60):
+        self.store = store
+        self.interval = interval
+        self.retention = retention
+        self.sweep_every = sweep_every
+        self._next_sweep = time.monotonic()
+        self._pending = {}  # game_id -> the newest StoredGame not written yet (None to delete it)
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="game store writer", daemon=True)
+        self._writer.start()
+
+    def save_many(self, records):  # Never touches the disk; a game saved again before the next write is only written once
+        with self._lock:
+            self._pending.update(records)
+
+    def load(self, game_id):  # Queued records are newer than the store's
+        with self._lock:
+            if game_id in self._pending: return self._pending[game_id]
+        return self.store.load(game_id)
+
+    def delete(self, game_id):
+        with self._lock:
+            self._pending[game_id] = None
+
+    def delete_older(self, seconds):  # Writes what's queued first, so that a game saved since the last write isn't forgotten
+        self.flush()
+        return self.store.delete_older(seconds)
+
+    def flush(self):  # Writes everything queued so far, on the calling thread
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        try:
+            saves = {game_id: record for game_id, record in pending.items() if record is not None}
+            if len(saves) > 0: self.store.save_many(saves)
+            for game_id, record in pending.items():
+                if record is None: self.store.delete(game_id)
+        except Exception:
+            with self._lock:  # Try again next time, unless a newer record has been queued since
+                for game_id, record in pending.items(): self._pending.setdefault(game_id, record)
+            raise
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed: self._wake.wait(self.interval)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception("Could not write games to the store")
+            if closed: return
+            if self.retention is not None and time.monotonic() >= self._next_sweep: self._sweep()
+
+    def _sweep(self):
+        self._next_sweep = time.monotonic()+self.sweep_every
+        try:
+            deleted = self.store.delete_older(self.retention)
+        except Exception:
+            logging.getLogger(__name__).exception("Could not delete old games from the store")
+        else:
+            if deleted > 0: logging.getLogger(__name__).info("Deleted %s games that were idle for over %s seconds", deleted, self.retention)
+
+    def close(self):  # Writes what's left and stops the writer
+        with self._lock:
+            self._closed = True
+            self._wake.notify_all()
+        self._writer.join()
+        self.store.close()
@@ -1,13 +1,18 @@
 from flask import Flask, render_template
 from backend import basic_cli, frontend_prototype
 import logging
+import os
 
 app = Flask(__name__)
 app.debug = True
+os.makedirs(app.instance_path, exist_ok=True)
+app.config["BASIC_CLI_STORE_PATH"] = os.path.join(app.instance_path, "games.sqlite3")  # Tables survive restarts
 logging.getLogger("werkzeug").disabled = True
 @app.route("/")
 def index():
     return render_template("index.html", scriptname="script/components.js")
 app.register_blueprint(basic_cli.bp)
 app.register_blueprint(frontend_prototype.bp)
-app.run()
+
+if __name__ == "__main__":  # Bot worker processes import this module too
+    app.run()
@@ -0,0 +1,115 @@
+from simulation import game
+from simulation import player
+from simulation.compact import CompactGame
+from simulation.policy import MoveEvaluator, POLICIES
+from collections import namedtuple
+import multiprocessing
+import random
+import importlib
+import inspect
+import argparse
+import json
+import csv
+import sys
+
+# Headless self-play: plays many seeded games across a process pool and streams one GameResult per game.
+# Player classes are constructed as cls(player_id, n_players, random_seed=...), so that every game is reproducible from its seed. Classes whose constructors take no random_seed
+# (neither by name nor through **kwargs) are constructed as cls(player_id, n_players); games with them are only reproducible if they don't play randomly.
+# Seats can also be policy names from simulation.policy.POLICIES, which read the engine's state directly; views are only built when some seat is a Player.
+# By default games are played on CompactGame unless a Player needs views, as building a view from a CompactState costs more than the compact engine saves.
+
+GameResult = namedtuple("GameResult", ("seed", "n_players", "players", "scores", "winners", "rounds", "moves"))
+FORMATS = ("jsonl", "csv")
+
+def _takes_seed(cls):  # Whether cls's constructor accepts random_seed
+    try: parameters = inspect.signature(cls).parameters.values()
+    except (TypeError, ValueError): return False  # No signature to look at
+    return any(parameter.name == "random_seed" or parameter.kind is parameter.VAR_KEYWORD for parameter in parameters)
+
+def _make_player(cls, player_id, n_players, random_seed):
+    if _takes_seed(cls): return cls(player_id, n_players, random_seed=random_seed)
+    return cls(player_id, n_players)
+
+def play_game(seed, player_classes, advanced=False, engine=None):  # player_classes has one Player class or policy name per seat
+    n_players = len(player_classes)
+    views = any(not isinstance(cls, str) for cls in player_classes)
+    if engine is None: engine = game.Game if views else CompactGame
+    g = engine.new_game(n_players, advanced, random_seed=seed)
+    players = [POLICIES[cls] if isinstance(cls, str) else _make_player(cls, i, n_players, seed*n_players+i) for i, cls in enumerate(player_classes)]
+    rgen = random.Random(seed)  # For the policies
+    rounds = 1
+    moves = 0
+    while g.turn >= 0:
+        turn = g.turn
+        if views:
+            view = g.view
+            for p in players:
+                if isinstance(p, player.Player): p.update(view)
+        if isinstance(players[turn], player.Player):
+            move = players[turn].play(g.check)
+            if move is None: raise game.ImpossibleGameFlowError(f"Player {turn} did not return a move.")
+        else:
+            move = game.decode_move(players[turn](MoveEvaluator.from_game(g), rgen), turn)
+        table = g.tiles_on_table
+        g.play(move)
+        moves += 1
+        if g.turn >= 0 and g.tiles_on_table > table: rounds += 1  # Tiles only ever leave the table, except when a new round is crafted
+    view = g.view
+    return GameResult(seed, n_players, [cls if isinstance(cls, str) else cls.__name__ for cls in player_classes], g.scores, view.winners, rounds, moves)
+
+def _play_game_star(args):  # Pool.imap only passes one argument
+    return play_game(*args)
+
+def run_batch(n_games, player_classes, first_seed=0, advanced=False, engine=None, processes=None, chunksize=16):  # Yields results as games finish, which is not necessarily in seed order
+    tasks = ((seed, player_classes, advanced, engine) for seed in range(first_seed, first_seed+n_games))
+    if processes == 1:
+        yield from map(_play_game_star, tasks)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(_play_game_star, tasks, chunksize)
+
+def write_results(results, file, fmt="jsonl"):  # Writes each result as soon as it arrives; returns how many were written
+    if fmt not in FORMATS: raise ValueError(f"Unknown format {fmt}; expected one of {', '.join(FORMATS)}.")
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(file)
+        writer.writerow(GameResult._fields)
+    n = 0
+    for result in results:
+        if writer is None:
+            file.write(json.dumps(result._asdict())+"\n")
+        else:
+            writer.writerow([" ".join(str(x) for x in value) if isinstance(value, list) else value for value in result])
+        file.flush()
+        n += 1
+    return n
+
+def load_class(path):  # "module.Class" -> the class
+    module, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play many seeded games between computer players and write one result per game.")
+    parser.add_argument("-n", "--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("-p", "--players", nargs="+", default=["simulation.player.RandomPlayer"]*2, help=f"one Player class (module.Class) or policy ({', '.join(POLICIES)}) per seat")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the first game; game i uses seed+i")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout")
+    parser.add_argument("--advanced", action="store_true")
+    args = parser.parse_args(argv)
+
+    if len(args.players) not in game.SETTINGS.N_BATCHES: parser.error(f"Games need {', '.join(str(n) for n in game.SETTINGS.N_BATCHES)} players, not {len(args.players)}.")
+    player_classes = [path if path in POLICIES else load_class(path) for path in args.players]
+    for cls in player_classes:
+        if not isinstance(cls, str) and not issubclass(cls, player.Player): parser.error(f"{cls.__name__} is not a Player.")
+    results = run_batch(args.games, player_classes, args.seed, args.advanced, processes=args.processes)
+    if args.output == "-":
+        write_results(results, sys.stdout, args.format)
+    else:
+        with open(args.output, "w", newline="") as file:
+            write_results(results, file, args.format)
+
+
+if __name__ == "__main__":
+    main()
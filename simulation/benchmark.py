@@ -0,0 +1,228 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactGame
+from simulation import serialize
+import argparse
+import platform
+import random
+import json
+import time
+import sys
+
+# Reproducible engine benchmarks: every position comes from a fixed seed, and each benchmark keeps the best of several repeats to cut down on noise.
+# Results are JSON ({"meta": {...}, "results": {name: {"ns_per_op", "ops_per_sec", "ops"}}}) so they can be saved as a baseline and compared against later.
+# Only the operation named is timed; restoring the position it needs in between is not.
+
+ENGINES = {"game": Game, "compact": CompactGame}
+SEED = 2020
+
+def _positions(engine, n_players, seed=SEED):  # Snapshots before every move of a seeded random game, with the moves, and the state before each round was scored
+    g = engine.new_game(n_players, False, random_seed=seed, record_undo=True)
+    rgen = random.Random(seed)
+    snapshots, moves, round_states = [], [], []
+    while g.turn >= 0:
+        snapshots.append(g.snapshot())
+        move = decode_move(rgen.choice(g.legal_moves()), g.turn)
+        moves.append(move)
+        table = g.tiles_on_table
+        g.play(move)
+        if g.turn < 0 or g.tiles_on_table > table: round_states.append(g._undo_stack[-1][-1])
+    return g, snapshots, moves, round_states
+
+def _timed(n, before, op):  # Total seconds op() takes over n calls, each after an untimed before()
+    total = 0.0
+    clock = time.perf_counter
+    for _ in range(n):
+        before()
+        start = clock()
+        op()
+        total += clock()-start
+    return total
+
+def bench_new_game(engine, n):
+    seeds = iter(range(n))
+    return _timed(n, lambda: None, lambda: engine.new_game(2, False, random_seed=next(seeds)))
+
+def bench_craft(engine, n):
+    games = []
+    return _timed(n, lambda: games.append(engine._empty_game(4, False, random_seed=len(games))), lambda: games[-1]._craft())
+
+def bench_draw(engine, n):  # Per draw, counting how many tiles a fresh supply gives before it runs out
+    games = []
+    draws = sum(engine._empty_game(2, False).state.supply.values())
+    def draw_all():
+        g = games[-1]
+        rgen = g._random()
+        for size in range(draws, 0, -1): g._draw(rgen, size)
+    return _timed(n, lambda: games.append(engine._empty_game(2, False, random_seed=len(games))), draw_all)/draws
+
+def bench_check(engine, n):  # Per move checked, over every candidate move in a mid-game position
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    moves = [decode_move(code, g.turn) for code in g.legal_moves()]
+    return _timed(n, lambda: None, lambda: [g.check(move) for move in moves])/len(moves)
+
+def bench_legal_moves(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    return _timed(n, lambda: None, g.legal_moves)
+
+def bench_play(engine, n):  # Over every move of a game in turn, including those that end rounds
+    g, snapshots, moves, _ = _positions(engine, 4)
+    i = [-1]
+    def before():
+        i[0] = (i[0]+1) % len(moves)
+        g.restore(snapshots[i[0]])
+    return _timed(n, before, lambda: g.play(moves[i[0]]))
+
+def bench_unplay(engine, n):
+    g, snapshots, moves, _ = _positions(engine, 4)
+    i = [-1]
+    def before():
+        i[0] = (i[0]+1) % len(moves)
+        g.restore(snapshots[i[0]])
+        g.play(moves[i[0]])
+    return _timed(n, before, g.unplay)
+
+def bench_score_round(engine, n):
+    g, _, _, round_states = _positions(engine, 4)
+    i = [-1]
+    def before():
+        i[0] = (i[0]+1) % len(round_states)
+        g._state = round_states[i[0]].copy()
+        g._recount()
+    return _timed(n, before, g._score_round)
+
+def bench_score_bonuses(engine, n):
+    g, _, _, _ = _positions(engine, 4)
+    return _timed(n, lambda: None, g._score_bonuses)
+
+def bench_copy(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    return _timed(n, lambda: None, g._state.copy)
+
+def bench_snapshot(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    return _timed(n, lambda: None, g.snapshot)
+
+def bench_view(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    return _timed(n, lambda: None, lambda: g.view)
+
+def bench_to_json(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    view = g.view
+    return _timed(n, lambda: None, lambda: serialize.to_json(view))
+
+def bench_to_bytes(engine, n):  # Straight from the engine's own state, which for CompactGame skips converting it
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    return _timed(n, lambda: None, lambda: serialize.to_bytes(g._state))
+
+def bench_from_bytes(engine, n):
+    g, snapshots, _, _ = _positions(engine, 4)
+    g.restore(snapshots[len(snapshots)//2])
+    data = serialize.to_bytes(g._state)
+    compact = engine is CompactGame
+    return _timed(n, lambda: None, lambda: serialize.from_bytes(data, compact))
+
+def _bench_games(n_players):
+    def bench_games(engine, n):  # Whole seeded games of random legal moves
+        seeds = iter(range(n))
+        def play_game():
+            seed = next(seeds)
+            g = engine.new_game(n_players, False, random_seed=seed)
+            rgen = random.Random(seed)
+            while g.turn >= 0: g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        return _timed(n, lambda: None, play_game)
+    return bench_games
+
+BENCHMARKS = {  # name -> (function(engine, n) returning the seconds n ops take, default n)
+    "new_game": (bench_new_game, 500),
+    "craft": (bench_craft, 500),
+    "draw": (bench_draw, 100),
+    "check": (bench_check, 200),
+    "legal_moves": (bench_legal_moves, 2000),
+    "play": (bench_play, 5000),
+    "unplay": (bench_unplay, 5000),
+    "score_round": (bench_score_round, 2000),
+    "score_bonuses": (bench_score_bonuses, 2000),
+    "copy": (bench_copy, 5000),
+    "snapshot": (bench_snapshot, 5000),
+    "view": (bench_view, 2000),
+    "to_json": (bench_to_json, 1000),
+    "to_bytes": (bench_to_bytes, 2000),
+    "from_bytes": (bench_from_bytes, 2000),
+    "games_2p": (_bench_games(2), 20),
+    "games_3p": (_bench_games(3), 20),
+    "games_4p": (_bench_games(4), 20),
+}
+
+def run(names=None, engines=None, repeat=5, scale=1.0):  # Results keyed "engine.benchmark"; scale multiplies every benchmark's number of ops
+    results = {}
+    for engine_name in engines or ENGINES:
+        for name in names or BENCHMARKS:
+            function, n = BENCHMARKS[name]
+            n = max(1, round(n*scale))
+            best = None
+            for _ in range(repeat):
+                per_op = function(ENGINES[engine_name], n)/n
+                if best is None or per_op < best: best = per_op
+            results[f"{engine_name}.{name}"] = {"ns_per_op": best*1e9, "ops_per_sec": 1/best if best > 0 else None, "ops": n}
+    return {"meta": {"python": platform.python_version(), "implementation": platform.python_implementation(), "machine": platform.machine(),
+        "processor": platform.processor(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat, "scale": scale}, "results": results}
+
+def compare(results, baseline, tolerance=0.1):  # (name, baseline ns, new ns, ratio, regressed) for every benchmark in both; regressed means more than tolerance slower
+    rows = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]: continue
+        old, new = baseline["results"][name]["ns_per_op"], result["ns_per_op"]
+        ratio = new/old
+        rows.append((name, old, new, ratio, ratio > 1+tolerance))
+    return rows
+
+def format_results(results, comparison=None):
+    compared = {row[0]: row for row in comparison or ()}
+    lines = [f"{'benchmark':28} {'ns/op':>12} {'ops/s':>12}"+(f" {'baseline':>12} {'change':>8}" if comparison is not None else "")]
+    for name, result in results["results"].items():
+        line = f"{name:28} {result['ns_per_op']:12.0f} {result['ops_per_sec']:12.1f}"
+        if name in compared:
+            _, old, _, ratio, regressed = compared[name]
+            line += f" {old:12.0f} {ratio-1:+8.1%}"+(" REGRESSED" if regressed else "")
+        lines.append(line)
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation engines and optionally compare against a saved baseline.")
+    parser.add_argument("-b", "--benchmarks", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("-e", "--engines", nargs="+", choices=list(ENGINES), help="engines to run them on (default: all)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="repeats per benchmark; the best is kept")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of operations per repeat")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file, or - for stdout")
+    parser.add_argument("--save", help="write the results as JSON to this file, as a baseline for later runs")
+    parser.add_argument("--baseline", help="compare against results saved with --save; exits with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="how much slower than the baseline counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.benchmarks, args.engines, args.repeat, args.scale)
+    comparison = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file), args.tolerance)
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        print(format_results(results, comparison))
+        if args.output is not None:
+            with open(args.output, "w") as file: json.dump(results, file, indent=1)
+    if args.save is not None:
+        with open(args.save, "w") as file: json.dump(results, file, indent=1)
+    if comparison is not None and any(row[4] for row in comparison): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
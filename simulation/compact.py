@@ -0,0 +1,342 @@
+from array import array
+from dataclasses import dataclass
+import typing
+from simulation import scoring
+from simulation.game import Game, GameState, PlayerState, DCounter, Tile, SETTINGS, IllegalGameOperationError, NO_ERROR, ZOBRIST_TURN, ZOBRIST_SOURCES, ZOBRIST_STAGES, ZOBRIST_FLOORS, ZOBRIST_PANELS, zobrist_score
+
+# A compact, array-backed alternative to GameState for high-volume simulation. Tiles are stored as their integer values.
+# Tile counts (batches, bench, supply, discard) are vectors of length SLOTS indexed by tile value, except that slot 0 (NONE is never counted) holds the first player tile.
+FIRST = 0
+SLOTS = 1+sum(1 for _ in Tile.color_tiles())
+COLORS = range(1, SLOTS)
+CELLS = SETTINGS.ROWS*SETTINGS.COLS
+TILES = {tile.value: tile for tile in Tile}
+PATTERN_COLS = tuple(tuple(row.index(TILES[color]) for color in COLORS) for row in SETTINGS.BASIC_PATTERN)  # PATTERN_COLS[row][color-1] is the column that color goes to in the basic pattern
+
+def _counts_from(counter):
+    counts = array("b", bytes(SLOTS))
+    for tile, n in counter.items():
+        counts[FIRST if tile is Tile.FIRST else tile.value] += n
+    return counts
+
+def _counter_from(counts):
+    return DCounter({(Tile.FIRST if i == FIRST else TILES[i]): n for i, n in enumerate(counts) if n > 0})
+
+
+@dataclass
+class CompactState:
+    n_players: int
+    advanced: bool
+    random_state: typing.Optional[object]
+    turn: int
+    scores: array  # One int per player
+    stage_contents: array  # ROWS tile values per player
+    stage_fullnesses: array  # ROWS fullnesses per player
+    panels: array  # ROWS*COLS tile values per player, row-major
+    panel_masks: array  # One occupancy bitmask per player, as in simulation.scoring
+    floors: typing.List[array]  # One variable-length array of tile values per player, in the order they landed
+    batches: array  # SLOTS counts per batch
+    bench: array
+    supply: typing.Optional[array]
+    discard: typing.Optional[array]
+
+    @classmethod
+    def from_state(cls, state: GameState):
+        boards = state.player_boards
+        return cls(
+            n_players=state.n_players,
+            advanced=state.advanced,
+            random_state=state.random_state,
+            turn=state.turn,
+            scores=array("i", [board.score for board in boards]),
+            stage_contents=array("b", [tile.value for board in boards for tile in board.stage_contents]),
+            stage_fullnesses=array("b", [n for board in boards for n in board.stage_fullnesses]),
+            panels=array("b", [tile.value for board in boards for row in board.panel for tile in row]),
+            panel_masks=array("l", [scoring.panel_mask(board.panel) for board in boards]),
+            floors=[array("b", [tile.value for tile in board.floor]) for board in boards],
+            batches=array("b", [n for batch in state.batches for n in _counts_from(batch)]),
+            bench=_counts_from(state.bench),
+            supply=None if state.supply is None else _counts_from(state.supply),
+            discard=None if state.discard is None else _counts_from(state.discard))
+
+    def to_state(self, hidden=True):
+        rows, cols = SETTINGS.ROWS, SETTINGS.COLS
+        boards = []
+        for p in range(self.n_players):
+            base = p*CELLS
+            boards.append(PlayerState(
+                advanced=self.advanced,
+                score=self.scores[p],
+                stage_contents=[TILES[v] for v in self.stage_contents[p*rows:(p+1)*rows]],
+                stage_fullnesses=list(self.stage_fullnesses[p*rows:(p+1)*rows]),
+                panel=[[TILES[v] for v in self.panels[base+row*cols:base+(row+1)*cols]] for row in range(rows)],
+                floor=[TILES[v] for v in self.floors[p]]))
+        return GameState(
+            n_players=self.n_players,
+            advanced=self.advanced,
+            random_state=self.random_state if hidden else None,
+            turn=self.turn,
+            player_boards=boards,
+            batches=[_counter_from(self.batches[i:i+SLOTS]) for i in range(0, len(self.batches), SLOTS)],
+            bench=_counter_from(self.bench),
+            supply=_counter_from(self.supply) if hidden and self.supply is not None else None,
+            discard=_counter_from(self.discard) if hidden and self.discard is not None else None)
+
+    def copy(self):
+        return CompactState(self.n_players, self.advanced, self.random_state, self.turn, self.scores[:], self.stage_contents[:], self.stage_fullnesses[:], self.panels[:], self.panel_masks[:],
+            [floor[:] for floor in self.floors], self.batches[:], self.bench[:],
+            None if self.supply is None else self.supply[:], None if self.discard is None else self.discard[:])
+
+    def __str__(self):
+        return str(self.to_state())
+
+
+class CompactGame(Game):  # Plays exactly like Game, but on a CompactState; state and view still return GameStates
+    def __init__(self, state, record_undo=False):
+        super().__init__(state if isinstance(state, CompactState) else CompactState.from_state(state), record_undo)
+
+    def _resupply(self):
+        supply, discard = self._state.supply, self._state.discard
+        for i in COLORS:
+            supply[i] += discard[i]
+            discard[i] = 0
+
+    def _draw(self, rgen, supply_size):
+        supply = self._state.supply
+        i = rgen.randrange(supply_size)
+        for color in COLORS:
+            n = supply[color]
+            if i < n:
+                supply[color] = n-1
+                return color
+            i -= n
+
+    def _craft(self):
+        state = self._state
+        state.bench[FIRST] += 1
+        self._tiles_on_table += 1
+        rgen = self._random()
+        supply_size = sum(state.supply)
+        batches = state.batches
+        for base in range(0, len(batches), SLOTS):
+            for _ in range(SETTINGS.TILES_PER_BATCH):
+                if supply_size == 0:
+                    supply_size = sum(state.discard)
+                    if supply_size == 0:  # Discard is empty -> cannot resupply
+                        state.random_state = self._rgen_state = rgen.getstate()
+                        return
+                    else:
+                        self._resupply()
+                batches[base+self._draw(rgen, supply_size)] += 1
+                supply_size -= 1
+                self._tiles_on_table += 1
+        state.random_state = self._rgen_state = rgen.getstate()
+
+    def play(self, move):
+        valid, error = self.check(move)
+        if not valid: raise error
+        state = self._state
+        floor = state.floors[move.player_id]
+        tile = move.tile.value
+        base = (move.source_id-1)*SLOTS
+        stage = move.player_id*SETTINGS.ROWS+move.dest_id-1
+        undo = None if not self.record_undo else (move, state.turn, state.bench[:] if move.source_id == 0 else state.batches[base:base+SLOTS], None if move.source_id == 0 else state.bench[:], len(floor),
+            None if move.dest_id == 0 else (state.stage_contents[stage], state.stage_fullnesses[stage]), self._tiles_on_table, self._position_hash)
+        h = self._position_hash ^ ZOBRIST_TURN[state.turn]
+        state.turn = (state.turn + 1) % state.n_players
+        h ^= ZOBRIST_TURN[state.turn]
+        source_keys = ZOBRIST_SOURCES[move.source_id]
+        floor_keys = ZOBRIST_FLOORS[move.player_id]
+        n_floor = floor.count(tile)
+        if move.source_id == 0:
+            source = state.bench
+            n_tiles = source[tile]
+            source[tile] = 0
+            h ^= source_keys[tile][n_tiles] ^ source_keys[tile][0]
+            if source[FIRST] > 0:
+                source[FIRST] -= 1
+                floor.append(Tile.FIRST.value)
+                self._tiles_on_table -= 1
+                h ^= source_keys[FIRST][1] ^ source_keys[FIRST][0] ^ floor_keys[FIRST][0] ^ floor_keys[FIRST][1]
+        else:
+            batches, bench = state.batches, state.bench
+            bench_keys = ZOBRIST_SOURCES[0]
+            n_tiles = batches[base+tile]
+            batches[base+tile] = 0
+            h ^= source_keys[tile][n_tiles] ^ source_keys[tile][0]
+            for i in COLORS:
+                n = batches[base+i]
+                if n > 0:
+                    h ^= source_keys[i][n] ^ source_keys[i][0] ^ bench_keys[i][bench[i]] ^ bench_keys[i][bench[i]+n]
+                    bench[i] += n
+                    batches[base+i] = 0
+        self._tiles_on_table -= n_tiles
+        if move.dest_id == 0:
+            floor.extend([tile]*n_tiles)
+            h ^= floor_keys[tile][n_floor] ^ floor_keys[tile][n_floor+n_tiles]
+        else:
+            stage_keys = ZOBRIST_STAGES[move.player_id][move.dest_id-1]
+            h ^= stage_keys[state.stage_contents[stage]][state.stage_fullnesses[stage]]
+            overflow = state.stage_fullnesses[stage]+n_tiles-move.dest_id
+            if overflow > 0:
+                floor.extend([tile]*overflow)
+                n_tiles -= overflow
+                h ^= floor_keys[tile][n_floor] ^ floor_keys[tile][n_floor+overflow]
+            state.stage_contents[stage] = tile
+            state.stage_fullnesses[stage] += n_tiles
+            h ^= stage_keys[tile][state.stage_fullnesses[stage]]
+        self._position_hash = h
+
+        if self._tiling_finished():
+            if undo is not None: self._undo_stack.append(undo+(state.copy(),))
+            self._end_round()
+            self._position_hash = self._compute_hash()
+        elif undo is not None:
+            self._undo_stack.append(undo+(None,))
+
+    def unplay(self):
+        if not self.record_undo: raise IllegalGameOperationError("This game doesn't record moves to take back; make it with record_undo=True.")
+        if len(self._undo_stack) == 0: raise IllegalGameOperationError("There is no move to take back.")
+        move, turn, source, bench, floor_length, stage, tiles_on_table, position_hash, round_state = self._undo_stack.pop()
+        if round_state is not None:
+            self._state = round_state.copy()  # Copied because snapshots share undo entries
+            self._recount()
+        self._tiles_on_table = tiles_on_table
+        self._position_hash = position_hash
+        state = self._state
+        state.turn = turn
+        if move.source_id == 0:
+            state.bench[:] = source
+        else:
+            base = (move.source_id-1)*SLOTS
+            state.batches[base:base+SLOTS] = source
+            state.bench[:] = bench
+        del state.floors[move.player_id][floor_length:]
+        if stage is not None:
+            index = move.player_id*SETTINGS.ROWS+move.dest_id-1
+            state.stage_contents[index], state.stage_fullnesses[index] = stage
+
+    def check(self, move):
+        state = self._state
+        if move.player_id != state.turn: return False, IllegalGameOperationError(f"It is player {state.turn}'s turn, not Player {move.player_id}'s.")
+        tile = move.tile.value
+        if (state.bench[tile] if move.source_id == 0 else state.batches[(move.source_id-1)*SLOTS+tile]) <= 0: return False, IllegalGameOperationError(f"No {move.tile} in {self.format_source(move.source_id, capitalize=True)}.")
+        if move.dest_id > 0:
+            row = move.dest_id-1
+            base = move.player_id*CELLS+row*SETTINGS.COLS
+            if tile in state.panels[base:base+SETTINGS.COLS]: return False, IllegalGameOperationError(f"Panel row {move.dest_id} already contains {move.tile}.")
+            content = state.stage_contents[move.player_id*SETTINGS.ROWS+row]
+            if content not in (tile, Tile.NONE.value): return False, IllegalGameOperationError(f"Cannot add {move.tile} to {TILES[content]} stage.")
+        return True, NO_ERROR
+
+    def iter_legal_moves(self):
+        state = self._state
+        if state.turn < 0: return
+        rows, cols = SETTINGS.ROWS, SETTINGS.COLS
+        stages = state.turn*rows
+        panel = state.panels[state.turn*CELLS:(state.turn+1)*CELLS]
+        open_rows = [None]*SLOTS
+        stride = rows+1
+        bench, batches = state.bench, state.batches
+        for source_id in range(len(batches)//SLOTS+1):
+            base = (source_id-1)*SLOTS
+            for color in COLORS:
+                if (bench[color] if source_id == 0 else batches[base+color]) == 0: continue
+                dests = open_rows[color]
+                if dests is None:
+                    dests = open_rows[color] = [0]+[row+1 for row in range(rows) if state.stage_contents[stages+row] in (color, 0) and color not in panel[row*cols:(row+1)*cols]]
+                code = (source_id*(SLOTS-1)+color-1)*stride
+                for dest_id in dests:
+                    yield code+dest_id
+
+    def _count_tiles_on_table(self):
+        return sum(self._state.batches)+sum(self._state.bench)
+
+    def _count_panel_row_fills(self):
+        return [scoring.POPCOUNT[scoring.row_bits(mask, row)] for mask in self._state.panel_masks for row in range(SETTINGS.ROWS)]
+
+    def _compute_hash(self):
+        state = self._state
+        rows = SETTINGS.ROWS
+        h = ZOBRIST_TURN[state.turn]
+        for source_id in range(len(state.batches)//SLOTS+1):
+            counts = state.bench if source_id == 0 else state.batches[(source_id-1)*SLOTS:source_id*SLOTS]
+            keys = ZOBRIST_SOURCES[source_id]
+            for slot in range(SLOTS): h ^= keys[slot][counts[slot]]
+        for p in range(state.n_players):
+            h ^= zobrist_score(p, state.scores[p])
+            for row in range(rows): h ^= ZOBRIST_STAGES[p][row][state.stage_contents[p*rows+row]][state.stage_fullnesses[p*rows+row]]
+            floor = state.floors[p]
+            h ^= ZOBRIST_FLOORS[p][FIRST][floor.count(Tile.FIRST.value)]
+            for color in COLORS: h ^= ZOBRIST_FLOORS[p][color][floor.count(color)]
+            for cell in range(CELLS):
+                tile = state.panels[p*CELLS+cell]
+                if tile > 0: h ^= ZOBRIST_PANELS[p][cell][tile]
+        return h
+
+    def _end_round(self):
+        first_player = -1
+        for i, floor in enumerate(self._state.floors):
+            if Tile.FIRST.value in floor:
+                first_player = i
+                break
+        assert first_player >= 0
+
+        self._score_round()
+        if self._game_over():
+            self._score_bonuses()
+            self._state.turn = -1
+            return
+        self._craft()
+
+        self._state.turn = first_player
+
+    def _score_round(self):  # Move over and discard tiles and score points
+        state = self._state
+        rows = SETTINGS.ROWS
+        for p in range(state.n_players):
+            for row in range(rows):
+                stage = p*rows+row
+                fullness = state.stage_fullnesses[stage]
+                if fullness == row+1:  # Stage is full
+                    content = state.stage_contents[stage]
+                    if state.advanced:
+                        raise NotImplementedError("Need to write this part still")
+                    col = PATTERN_COLS[row][content-1]
+                    state.panels[p*CELLS+row*SETTINGS.COLS+col] = content
+                    state.panel_masks[p] |= 1 << (row*SETTINGS.COLS+col)
+                    state.scores[p] += scoring.score_tile(state.panel_masks[p], row, col)
+                    self._panel_row_fills[stage] += 1
+                    if self._panel_row_fills[stage] == SETTINGS.COLS: self._full_rows += 1
+                    state.discard[content] += fullness-1  # We discard all of the tiles but the one going onto the panel
+                    state.stage_fullnesses[stage] = 0
+                    state.stage_contents[stage] = 0
+
+            # Score the floor and discard it
+            floor = state.floors[p]
+            state.scores[p] -= sum(SETTINGS.PENALTIES[:len(floor)])
+            for tile in floor:
+                if tile > 0: state.discard[tile] += 1  # The first player tile goes back to the bench in _craft rather than into the supply
+            state.floors[p] = array("b")
+
+    def _score_bonuses(self):
+        state = self._state
+        colors = scoring.BASIC_COLOR_MASKS
+        for p in range(state.n_players):
+            if state.advanced: colors = scoring.color_masks(state.panels[p*CELLS:(p+1)*CELLS])
+            state.scores[p] += scoring.score_bonuses(state.panel_masks[p], colors)
+
+    @property
+    def state(self):
+        return self._state.to_state()
+
+    @property
+    def view(self):
+        return self._state.to_state(hidden=False)
+
+    @property
+    def scores(self):
+        return list(self._state.scores)
+
+    def __str__(self):
+        return str(self._state)
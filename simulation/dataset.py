@@ -0,0 +1,182 @@
+from simulation.game import Tile, SETTINGS, encode_move, decode_move
+from simulation.compact import CompactGame, SLOTS, COLORS, CELLS
+from simulation.player import Player
+from simulation.policy import MoveEvaluator, POLICIES
+from simulation.batch import load_class
+import numpy as np
+import multiprocessing
+import argparse
+import random
+import glob
+import sys
+import os
+
+# Training data from self-play. Every ply becomes one fixed-size record of what the player to move can see, the move they made and how the game ended, all from the mover's point of view:
+# players are rotated so that index 0 is the mover and index 1 plays next, and seats past n_players are zeros.
+# Plies are captured as raw bytes straight out of the CompactState while the game is played, and each finished game is turned into records in one vectorized pass.
+# Records go to shards of at most shard_size records, each a .npy file of RECORD that np.load(path, mmap_mode="r") maps without reading it in, so memory stays bounded on both ends.
+# Workers each play their own range of seeds and write their own shards, so only counts cross between processes.
+
+MAX_PLAYERS = max(SETTINGS.N_BATCHES)
+MAX_SOURCES = 1+max(SETTINGS.N_BATCHES.values())
+ROWS = SETTINGS.ROWS
+FLOOR_SLOTS = (Tile.FIRST.value,)+tuple(COLORS)  # Tile values in slot order, for counting floors
+SHARD_SIZE = 1 << 16
+GAMES_PER_TASK = 500
+
+RECORD = np.dtype([
+    ("game", "i8"),  # The seed
+    ("ply", "i2"),
+    ("n_players", "i1"),
+    ("turn", "i1"),  # The mover's seat
+    ("sources", "i1", (MAX_SOURCES, SLOTS)),  # Counts by slot (as in CompactState), bench first; source IDs are as in moves
+    ("stage_contents", "i1", (MAX_PLAYERS, ROWS)),
+    ("stage_fullnesses", "i1", (MAX_PLAYERS, ROWS)),
+    ("panels", "i1", (MAX_PLAYERS, CELLS)),  # Tile values, row-major
+    ("floors", "i1", (MAX_PLAYERS, SLOTS)),  # Counts by slot
+    ("scores", "i2", (MAX_PLAYERS,)),
+    ("move", "i2"),  # encode_move() code
+    ("final_scores", "i2", (MAX_PLAYERS,)),
+    ("margin", "i2"),  # The mover's final score less the best of the others'
+    ("won", "i1")])  # Whether the mover was among the winners
+
+def _capture(state):  # The visible part of a CompactState as bytes: bench, batches, stage contents, stage fullnesses, panels and floor counts
+    floors = bytes(floor.count(value) for floor in state.floors for value in FLOOR_SLOTS)
+    return state.bench.tobytes()+state.batches.tobytes()+state.stage_contents.tobytes()+state.stage_fullnesses.tobytes()+state.panels.tobytes()+floors
+
+def encode_game(seed, n_players, plies, scores, turns, moves, final_scores, winners):  # RECORDs for one finished game, from the plies _capture()d before each of its moves
+    n, n_plies = n_players, len(plies)
+    n_sources = 1+SETTINGS.N_BATCHES[n]
+    raw = np.frombuffer(b"".join(plies), dtype=np.int8).reshape(n_plies, -1)
+    fields = {}
+    i = 0
+    for name, shape in (("sources", (n_sources, SLOTS)), ("stage_contents", (n, ROWS)), ("stage_fullnesses", (n, ROWS)), ("panels", (n, CELLS)), ("floors", (n, SLOTS))):
+        size = shape[0]*shape[1]
+        fields[name] = raw[:, i:i+size].reshape(n_plies, *shape)
+        i += size
+    turns = np.array(turns, dtype=np.int8)
+    rotation = (turns[:, None]+np.arange(n)) % n  # rotation[ply, j] is the seat j places after that ply's mover
+    plies_index = np.arange(n_plies)[:, None]
+    final = np.array(final_scores, dtype=np.int16)[rotation]
+    won = np.zeros(n, dtype=np.int8)
+    won[winners] = 1
+
+    records = np.zeros(n_plies, dtype=RECORD)
+    records["game"] = seed
+    records["ply"] = np.arange(n_plies)
+    records["n_players"] = n
+    records["turn"] = turns
+    records["sources"][:, :n_sources] = fields["sources"]
+    for name in ("stage_contents", "stage_fullnesses", "panels", "floors"):
+        records[name][:, :n] = fields[name][plies_index, rotation]
+    records["scores"][:, :n] = np.array(scores, dtype=np.int16)[plies_index, rotation]
+    records["move"] = moves
+    records["final_scores"][:, :n] = final
+    records["margin"] = final[:, 0]-final[:, 1:].max(axis=1)
+    records["won"] = won[turns]
+    return records
+
+def play_game(seed, players):  # players has one policy name (from POLICIES) or Player class per seat; returns the game's RECORDs
+    n = len(players)
+    g = CompactGame.new_game(n, False, random_seed=seed)
+    seats = [POLICIES[player] if isinstance(player, str) else player(i, n, random_seed=seed*n+i) for i, player in enumerate(players)]
+    views = any(isinstance(seat, Player) for seat in seats)  # Policies read the state directly, so views are only built for Players
+    rgen = random.Random(seed)
+    plies, scores, turns, moves = [], [], [], []
+    while g.turn >= 0:
+        state = g._state
+        turn = state.turn
+        plies.append(_capture(state))
+        scores.append(state.scores.tolist())
+        turns.append(turn)
+        if views:
+            view = g.view
+            for seat in seats:
+                if isinstance(seat, Player): seat.update(view)
+        seat = seats[turn]
+        if isinstance(seat, Player):
+            move = seat.play(g.check)
+            code = encode_move(move)
+        else:
+            code = seat(MoveEvaluator.from_game(g), rgen)
+            move = decode_move(code, turn)
+        moves.append(code)
+        g.play(move)
+    return encode_game(seed, n, plies, scores, turns, moves, g.scores, g.view.winners)
+
+
+class ShardWriter:  # Buffers records and writes every shard_size of them to directory/prefix-NNNN.npy
+    def __init__(self, directory, prefix="shard", shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.paths = []
+        self.count = 0
+        self._buffer = np.zeros(shard_size, dtype=RECORD)
+        self._n = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, records):
+        i = 0
+        while i < len(records):
+            n = min(len(records)-i, self.shard_size-self._n)
+            self._buffer[self._n:self._n+n] = records[i:i+n]
+            self._n += n
+            i += n
+            if self._n == self.shard_size: self.flush()
+        self.count += len(records)
+
+    def flush(self):  # Writes whatever is buffered as a (possibly short) shard
+        if self._n == 0: return
+        path = os.path.join(self.directory, f"{self.prefix}-{len(self.paths):04d}.npy")
+        with open(path+".tmp", "wb") as file: np.save(file, self._buffer[:self._n])
+        os.replace(path+".tmp", path)  # Readers never see half a shard
+        self.paths.append(path)
+        self._n = 0
+
+    def close(self):
+        self.flush()
+        return self.paths
+
+def _write_games(task):  # Runs in a worker: plays a range of seeds into its own shards; returns how many records it wrote
+    seeds, players, directory, shard_size = task
+    writer = ShardWriter(directory, f"shard-{seeds.start:010d}", shard_size)
+    for seed in seeds: writer.write(play_game(seed, players))
+    writer.close()
+    return writer.count
+
+def generate(directory, n_games, players, first_seed=0, processes=None, shard_size=SHARD_SIZE, games_per_task=GAMES_PER_TASK):  # Yields each task's record count as it finishes
+    tasks = [(range(start, min(start+games_per_task, first_seed+n_games)), players, directory, shard_size) for start in range(first_seed, first_seed+n_games, games_per_task)]
+    if processes == 1:
+        yield from map(_write_games, tasks)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(_write_games, tasks)
+
+def open_shards(directory):  # Every shard in directory, memory-mapped, in seed order
+    return [np.load(path, mmap_mode="r") for path in sorted(glob.glob(os.path.join(directory, "shard-*.npy")))]
+
+def iter_batches(directory, batch_size=4096):  # Consecutive slices of at most batch_size records; each is read from disk only when used
+    for shard in open_shards(directory):
+        for i in range(0, len(shard), batch_size): yield shard[i:i+batch_size]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play seeded self-play games and write every ply as a training record to sharded .npy files.")
+    parser.add_argument("output", help="directory for the shards")
+    parser.add_argument("-n", "--games", type=int, default=1000, help="number of games to play")
+    parser.add_argument("-p", "--players", nargs="+", default=["greedy"]*2, help=f"one policy ({', '.join(POLICIES)}) or Player class (module.Class) per seat")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the first game; game i uses seed+i")
+    parser.add_argument("-j", "--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="records per shard")
+    parser.add_argument("--games-per-task", type=int, default=GAMES_PER_TASK, help="games each worker plays into its own shards at a time")
+    args = parser.parse_args(argv)
+
+    players = [player if player in POLICIES else load_class(player) for player in args.players]
+    total = 0
+    for count in generate(args.output, args.games, players, args.seed, args.processes, args.shard_size, args.games_per_task):
+        total += count
+        print(f"{total} records", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+from simulation.game import Game, SETTINGS, decode_move, _zobrist_keys, _MAX_PLAYERS
+from simulation.compact import CompactGame, CompactState, COLORS, PATTERN_COLS
+from simulation.policy import MoveEvaluator, PolicyPlayer, PENALTY_TOTALS, greedy_policy
+from simulation.transposition import TranspositionTable
+from simulation.symmetry import batch_counts, canonical_form, duplicate_sources, to_canonical, to_original, STRIDE
+from simulation import scoring
+from collections import namedtuple
+import random
+import time
+
+# Exact search of the rest of a round. Nothing is drawn until the round ends, so the moves left in it form a finite game tree.
+# A leaf is a move that takes the last tiles off the table, and its value is what _score_round (and _score_bonuses, if the game ends) would make the scores, computed here rather than played:
+# playing it would craft the next round, which needs the hidden supply and is random anyway. So positions can be views.
+# Values are one player's margin over the best of the others, with everyone else playing against them (paranoid alpha-beta, which is exact for two players).
+# Search deepens one ply at a time, memoizing positions in a TranspositionTable by canonical_hash (so batch order doesn't matter), and skipping moves from batches identical to an earlier one, until it reaches the end of the round or runs out of nodes or time.
+# Then the last complete depth's move stands, with leaves at the depth limit valued as if the round ended there.
+
+EXACT, LOWER, UPPER = 0, 1, 2  # How a memoized value bounds the true one
+SOLVED = 1 << 30  # The depth memoized for values that were searched to the end of the round, which are good at any depth
+WIN = 1 << 20  # Bigger than any margin
+CHECK_EVERY = 256  # Nodes between looks at the clock
+MAX_TILES = 12  # EndgamePlayer solves rounds with at most this many tiles left on the table
+_ROOT_KEYS = _zobrist_keys(random.Random(0x5017), _MAX_PLAYERS)  # Mixed into memo keys, as values are margins for the player being solved for
+
+Solution = namedtuple("Solution", ("move", "margin", "exact", "depth", "nodes"))  # exact means margin is the end of round margin with best play; otherwise both come from the deepest search finished
+
+class _OutOfBudget(Exception):
+    pass
+
+def _boards(state):  # (score, stage contents, stage fullnesses, panel mask, floor length) per player, from a GameState (or a view) or a CompactState
+    if state.advanced: raise NotImplementedError("Need to write this part still")
+    if isinstance(state, CompactState):
+        rows = SETTINGS.ROWS
+        return [(state.scores[p], state.stage_contents[p*rows:(p+1)*rows].tolist(), state.stage_fullnesses[p*rows:(p+1)*rows].tolist(), state.panel_masks[p], len(state.floors[p]))
+            for p in range(state.n_players)]
+    return [(board.score, [tile.value for tile in board.stage_contents], list(board.stage_fullnesses), scoring.panel_mask(board.panel), len(board.floor)) for board in state.player_boards]
+
+def round_end_scores(boards):  # The scores if the round ended with boards as they are, as _score_round and then (if a panel row is full) _score_bonuses would make them
+    scores, masks = [], []
+    for score, contents, fullnesses, mask, floor_length in boards:
+        for row in range(SETTINGS.ROWS):
+            if fullnesses[row] == row+1:
+                col = PATTERN_COLS[row][contents[row]-1]
+                mask |= 1 << (row*SETTINGS.COLS+col)
+                score += scoring.score_tile(mask, row, col)
+        scores.append(score-PENALTY_TOTALS[floor_length])
+        masks.append(mask)
+    if any(scoring.row_bits(mask, row) == scoring.FULL_ROW for mask in masks for row in range(SETTINGS.ROWS)):
+        scores = [score+bonus for score, bonus in zip(scores, [scoring.score_bonuses(mask) for mask in masks])]
+    return scores
+
+def margin(scores, player_id):
+    return scores[player_id]-max(score for p, score in enumerate(scores) if p != player_id)
+
+
+class Solver:
+    def __init__(self, table=None, max_nodes=None, time_limit=None):  # Default limits for solve(); None is unlimited
+        self.table = table if table is not None else TranspositionTable(1 << 18)
+        self.max_nodes = max_nodes
+        self.time_limit = time_limit
+        self.nodes = 0
+        self._player = None
+        self._root_key = 0
+        self._node_limit = None
+        self._deadline = None
+
+    def solve(self, game, player_id=None, max_nodes=None, time_limit=None):  # The best move for whoever's turn it is in game (a Game, CompactGame, GameState, view or CompactState), valued for player_id (by default, the mover)
+        state = game._state if isinstance(game, Game) else game
+        if state.turn < 0: raise ValueError("The game is over.")
+        g = CompactGame(state.copy() if isinstance(state, CompactState) else state, record_undo=True)  # Converting a GameState copies it anyway. Only ever played short of the end of the round, so views work
+        self._player = state.turn if player_id is None else player_id
+        self._root_key = _ROOT_KEYS[self._player]
+        max_nodes = self.max_nodes if max_nodes is None else max_nodes
+        time_limit = self.time_limit if time_limit is None else time_limit
+        self.nodes = 0
+        self._node_limit = max_nodes
+        self._deadline = None if time_limit is None else time.perf_counter()+time_limit
+        self.table.new_search()
+        solution = None
+        depth = 1
+        while True:
+            try:
+                value, resolved, code = self._search(g, depth, -WIN, WIN)
+            except _OutOfBudget:
+                break
+            solution = Solution(decode_move(code, state.turn), value, resolved, depth, self.nodes)
+            if resolved: break
+            depth += 1
+        if solution is None:  # Not even one ply fit in the budget
+            code = greedy_policy(MoveEvaluator.from_state(state), random.Random(0))
+            solution = Solution(decode_move(code, state.turn), margin(round_end_scores(_boards(state)), self._player), False, 0, self.nodes)
+        return solution._replace(nodes=self.nodes)
+
+    def _search(self, g, depth, alpha, beta):  # (value, whether it is exact rather than from the depth limit, best code) for g's position, searched depth plies
+        self.nodes += 1
+        if self._node_limit is not None and self.nodes > self._node_limit: raise _OutOfBudget
+        if self._deadline is not None and self.nodes % CHECK_EVERY == 0 and time.perf_counter() > self._deadline: raise _OutOfBudget
+        counts = batch_counts(g._state)
+        key, order = canonical_form(g, counts)
+        key ^= self._root_key
+        entry = self.table.get(key)
+        best_code = None
+        if entry is not None:
+            entry_depth, value, bound, best_code = entry
+            best_code = to_original(best_code, order)  # Memoized in the canonical numbering
+            if entry_depth >= depth and (bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha)):
+                return value, entry_depth == SOLVED, best_code
+        state = g._state
+        if depth == 0: return margin(round_end_scores(_boards(state)), self._player), False, None
+
+        evaluator = MoveEvaluator.from_state(state)
+        duplicates = duplicate_sources(state, counts)
+        moves = [outcome for outcome in evaluator.outcomes() if outcome[0]//STRIDE not in duplicates]
+        moves.sort(key=lambda outcome: (outcome[0] != best_code, outcome[2]-outcome[1], -outcome[3]))  # The memoized best move first, then greedily
+        maximizing = state.turn == self._player
+        tiles = g.tiles_on_table
+        boards = None
+        best, resolved = None, True
+        original_alpha, original_beta = alpha, beta
+        for code, _, _, placed, floored in moves:
+            if placed+floored == tiles:  # Takes the last tiles, so the round ends
+                if boards is None: boards = _boards(state)
+                value, child_resolved = margin(round_end_scores(self._after(boards, state.turn, code, placed, floored)), self._player), True
+            else:
+                g.play(decode_move(code, state.turn))
+                value, child_resolved, _ = self._search(g, depth-1, alpha, beta)
+                g.unplay()
+            resolved = resolved and child_resolved
+            if best is None or (value > best if maximizing else value < best): best, best_code = value, code
+            if maximizing: alpha = max(alpha, value)
+            else: beta = min(beta, value)
+            if alpha >= beta: break
+        bound = UPPER if best <= original_alpha else LOWER if best >= original_beta else EXACT
+        self.table.put(key, (SOLVED if resolved else depth, best, bound, to_canonical(best_code, order)), SOLVED if resolved else depth)
+        return best, resolved, best_code
+
+    @staticmethod
+    def _after(boards, mover, code, placed, floored):  # boards once the mover has played code
+        boards = list(boards)
+        score, contents, fullnesses, mask, floor_length = boards[mover]
+        dest_id = code % (SETTINGS.ROWS+1)
+        if dest_id > 0:
+            contents, fullnesses = contents[:], fullnesses[:]
+            contents[dest_id-1] = code//(SETTINGS.ROWS+1) % len(COLORS)+1
+            fullnesses[dest_id-1] += placed
+        boards[mover] = (score, contents, fullnesses, mask, floor_length+floored)
+        return boards
+
+def solve(game, player_id=None, max_nodes=None, time_limit=None, table=None):
+    return Solver(table).solve(game, player_id, max_nodes, time_limit)
+
+
+class EndgamePlayer(PolicyPlayer):  # Plays solved moves once the round is down to max_tiles tiles, and its policy's before that
+    policy = staticmethod(greedy_policy)
+
+    def __init__(self, player_id, n_players, random_seed=None, max_tiles=MAX_TILES, max_nodes=200000, time_limit=1.0, table=None):
+        super().__init__(player_id, n_players, random_seed)
+        self.max_tiles = max_tiles
+        self.solver = Solver(table, max_nodes, time_limit)
+
+    def play(self, validator):
+        view = self.game_state
+        if sum(sum(source.values()) for source in view.batches+[view.bench]) <= self.max_tiles: return self.solver.solve(view, self.player_id).move
+        return super().play(validator)
@@ -0,0 +1,127 @@
+from simulation.game import SETTINGS, COLOR_TILES, DCounter, decode_move
+from simulation.compact import CompactGame, CompactState, PATTERN_COLS
+from simulation.policy import PolicyPlayer, PENALTY_TOTALS
+from simulation.mcts import unseen_tiles
+from simulation import scoring
+from collections import namedtuple
+import numpy as np
+import random
+
+# Heuristic evaluation of many positions at once. The positions' boards are stacked into arrays once, and everything after that is a NumPy operation over the whole batch:
+# each player's projected score is what _score_round would make it if the round ended now (full stages moved over and scored in row order, and the floor penalty),
+# plus how far along they are toward each of _score_bonuses's bonuses, counted as the bonus times the square of the fraction of the line or color that is filled.
+# A position's value is one player's projected score less the best of the others'. Positions can be GameStates (or views) or CompactStates, mixed; only the basic pattern is supported.
+
+MAX_PLAYERS = max(SETTINGS.N_BATCHES)
+ROWS, COLS = SETTINGS.ROWS, SETTINGS.COLS
+BONUS_WEIGHT = 1.0  # How much bonus progress counts toward a value
+FEATURES = ("score", "round_points", "floor_penalty", "projected_score", "bonuses", "bonus_progress")
+
+Positions = namedtuple("Positions", ("n_players", "turns", "present", "scores", "masks", "stage_contents", "stage_fullnesses", "floor_lengths"))  # Arrays over (position[, player[, row]]), with seats past n_players absent and zeroed
+
+_POPCOUNT = np.array(scoring.POPCOUNT)
+_PATTERN_COLS = np.array(PATTERN_COLS)
+_PENALTY_TOTALS = np.array(PENALTY_TOTALS)
+_SEATS = np.arange(MAX_PLAYERS)
+
+def stack(states):  # The one pass that looks at each state in Python
+    n = len(states)
+    n_players, turns = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    scores, masks, floor_lengths = np.zeros((n, MAX_PLAYERS), dtype=np.int64), np.zeros((n, MAX_PLAYERS), dtype=np.int64), np.zeros((n, MAX_PLAYERS), dtype=np.int64)
+    stage_contents, stage_fullnesses = np.zeros((n, MAX_PLAYERS, ROWS), dtype=np.int64), np.zeros((n, MAX_PLAYERS, ROWS), dtype=np.int64)
+    for i, state in enumerate(states):
+        if state.advanced: raise NotImplementedError("Need to write this part still")
+        p = state.n_players
+        n_players[i], turns[i] = p, state.turn
+        if isinstance(state, CompactState):
+            scores[i, :p] = state.scores
+            masks[i, :p] = state.panel_masks
+            stage_contents[i, :p] = np.frombuffer(state.stage_contents, dtype=np.int8).reshape(p, ROWS)
+            stage_fullnesses[i, :p] = np.frombuffer(state.stage_fullnesses, dtype=np.int8).reshape(p, ROWS)
+            floor_lengths[i, :p] = [len(floor) for floor in state.floors]
+        else:
+            boards = state.player_boards
+            scores[i, :p] = [board.score for board in boards]
+            masks[i, :p] = [scoring.panel_mask(board.panel) for board in boards]
+            stage_contents[i, :p] = [[tile.value for tile in board.stage_contents] for board in boards]
+            stage_fullnesses[i, :p] = [board.stage_fullnesses for board in boards]
+            floor_lengths[i, :p] = [len(board.floor) for board in boards]
+    return Positions(n_players, turns, _SEATS < n_players[:, None], scores, masks, stage_contents, stage_fullnesses, floor_lengths)
+
+def _cell_bits(masks, row, cols):  # Whether each panel has a tile at (row, cols), with cols broadcast against masks
+    return (masks >> (row*COLS+cols)) & 1
+
+def round_points(positions):  # (points each player's full stages would score, their panel masks once those tiles are on), as in _score_round
+    masks = positions.masks.copy()
+    points = np.zeros_like(masks)
+    for row in range(ROWS):
+        full = positions.stage_fullnesses[..., row] == row+1
+        col = _PATTERN_COLS[row][np.maximum(positions.stage_contents[..., row]-1, 0)]
+        masks |= np.where(full, 1 << (row*COLS+col), 0)
+        points += np.where(full, scoring.score_tiles_many(masks, row, col), 0)
+    return points, masks
+
+def floor_penalties(positions):
+    return _PENALTY_TOTALS[positions.floor_lengths]
+
+def bonuses(masks):  # (the bonuses each panel has earned, its progress toward all of them), as in _score_bonuses
+    progress = np.zeros(masks.shape)
+    for row in range(ROWS):
+        filled = _POPCOUNT[(masks >> (row*COLS)) & scoring.FULL_ROW]
+        progress += SETTINGS.BONUSES.HORIZONTAL*(filled/COLS)**2
+    for col in range(COLS):
+        filled = sum(_cell_bits(masks, row, col) for row in range(ROWS))
+        progress += SETTINGS.BONUSES.VERTICAL*(filled/ROWS)**2
+    for color in range(len(COLOR_TILES)):
+        filled = sum(_cell_bits(masks, row, PATTERN_COLS[row][color]) for row in range(ROWS))
+        progress += SETTINGS.BONUSES.COLOR*(filled/scoring.N_COLOR)**2
+    return scoring.score_bonuses_many(masks), progress
+
+def features(states, player_ids=None):  # float32 of shape (positions, MAX_PLAYERS, len(FEATURES)), with players rotated so that index 0 is player_ids (by default, the mover) and index 1 plays next
+    positions = stack(states)
+    points, masks = round_points(positions)
+    penalties = floor_penalties(positions)
+    earned, progress = bonuses(masks)
+    table = np.stack([positions.scores, points, penalties, positions.scores+points-penalties, earned, progress], axis=-1).astype(np.float32)
+    table[~positions.present] = 0
+    rotation = (_players(positions, player_ids)[:, None]+_SEATS) % positions.n_players[:, None]
+    rotated = table[np.arange(len(table))[:, None], rotation]
+    rotated[~positions.present] = 0
+    return rotated
+
+def evaluate(states, player_ids=None, bonus_weight=BONUS_WEIGHT):  # Each position's value for player_ids (by default, the mover), as a float array
+    positions = stack(states)
+    points, masks = round_points(positions)
+    _, progress = bonuses(masks)
+    values = positions.scores+points-floor_penalties(positions)+bonus_weight*progress
+    players = _players(positions, player_ids)
+    others = np.where(positions.present & (_SEATS != players[:, None]), values, -np.inf)
+    return values[np.arange(len(values)), players]-others.max(axis=1)
+
+def _players(positions, player_ids):
+    players = positions.turns if player_ids is None else np.broadcast_to(np.asarray(player_ids, dtype=np.int64), positions.turns.shape)
+    if np.any(players < 0) or np.any(players >= positions.n_players): raise ValueError("Finished games have no mover; pass player_ids for them.")
+    return players
+
+
+class LookaheadPlayer(PolicyPlayer):  # Plays the move whose resulting position evaluate() likes best for it, scoring all of them in one batch
+    def __init__(self, player_id, n_players, random_seed=None, bonus_weight=BONUS_WEIGHT):
+        super().__init__(player_id, n_players, random_seed)
+        self.bonus_weight = bonus_weight
+
+    def play(self, validator):
+        view = self.game_state
+        state = view.copy()  # A move that ends the round crafts the next, so the unseen tiles stand in for the supply, as in MCTS's determinizations
+        state.supply = unseen_tiles(view)
+        state.discard = DCounter({tile: 0 for tile in COLOR_TILES})
+        state.random_state = random.Random(self.rgen.getrandbits(64)).getstate()
+        g = CompactGame(state, record_undo=True)
+        codes = g.legal_moves()
+        children = []
+        for code in codes:
+            g.play(decode_move(code, self.player_id))
+            children.append(g._state.copy())
+            g.unplay()
+        values = evaluate(children, self.player_id, self.bonus_weight)
+        best = np.flatnonzero(values == values.max())
+        return decode_move(codes[self.rgen.choice(best.tolist())], self.player_id)
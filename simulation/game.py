@@ -5,6 +5,7 @@ import typing
 from collections import namedtuple
 import random
 import hashlib
+from simulation import profiling
 
 debug = False
 
@@ -89,6 +90,40 @@ class IllegalGameOperationError(Error):
 class ImpossibleGameFlowError(Error):
     pass
 
+NO_ERROR = ImpossibleGameFlowError("This error should not be thrown")  # Returned alongside every valid check() so that valid moves don't each build an exception
+
+COLOR_TILES = tuple(Tile.color_tiles())
+
+def encode_move(move):  # Packs a Move's source, tile, and destination into one small int; the player is implied by whose turn it is
+    return (move.source_id*len(COLOR_TILES)+move.tile.value-1)*(SETTINGS.ROWS+1)+move.dest_id
+
+def decode_move(code, player_id):
+    rest, dest_id = divmod(code, SETTINGS.ROWS+1)
+    source_id, color = divmod(rest, len(COLOR_TILES))
+    return Move(player_id, COLOR_TILES[color], source_id, dest_id)
+
+# Zobrist keys for Game.position_hash, which covers everything players can see (not the supply, the discard or random_state).
+# Tiles are indexed by slot: 0 for the first player tile (or an empty stage or cell) and the tile value for colors. The seed is fixed so that hashes agree between processes.
+def _zobrist_keys(rgen, *shape):
+    if len(shape) == 0: return rgen.getrandbits(64)
+    return [_zobrist_keys(rgen, *shape[1:]) for _ in range(shape[0])]
+
+_ZOBRIST_RGEN = random.Random(0x1217)
+_MAX_PLAYERS = max(SETTINGS.N_BATCHES)
+_MAX_COUNT = max(SETTINGS.INVENTORY.values())
+ZOBRIST_TURN = _zobrist_keys(_ZOBRIST_RGEN, _MAX_PLAYERS+1)  # Indexed by turn, so the game over turn of -1 gets the last key
+ZOBRIST_SOURCES = _zobrist_keys(_ZOBRIST_RGEN, 1+max(SETTINGS.N_BATCHES.values()), 1+len(COLOR_TILES), _MAX_COUNT+1)  # [source_id][slot][count], source 0 being the bench
+ZOBRIST_STAGES = _zobrist_keys(_ZOBRIST_RGEN, _MAX_PLAYERS, SETTINGS.ROWS, 1+len(COLOR_TILES), SETTINGS.ROWS+1)  # [player][row][slot][fullness]
+ZOBRIST_FLOORS = _zobrist_keys(_ZOBRIST_RGEN, _MAX_PLAYERS, 1+len(COLOR_TILES), _MAX_COUNT+1)  # [player][slot][count]
+ZOBRIST_PANELS = _zobrist_keys(_ZOBRIST_RGEN, _MAX_PLAYERS, SETTINGS.ROWS*SETTINGS.COLS, 1+len(COLOR_TILES))  # [player][cell][slot], only for filled cells
+_ZOBRIST_SCORE = _zobrist_keys(_ZOBRIST_RGEN)
+
+def zobrist_score(player_id, score):  # Scores have no fixed range, so their keys are mixed up from the score rather than looked up
+    x = (_ZOBRIST_SCORE+(player_id << 32)+score) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30))*0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27))*0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
 @dataclass
 class PlayerState:
     advanced: bool
@@ -98,6 +133,9 @@ class PlayerState:
     panel: typing.List[typing.List[Tile]] = field(default_factory=lambda: [[Tile.NONE for j in range(SETTINGS.COLS)] for i in range(SETTINGS.ROWS)])
     floor: typing.List[Tile] = field(default_factory=lambda: [])
 
+    def copy(self):
+        return PlayerState(self.advanced, self.score, self.stage_contents[:], self.stage_fullnesses[:], [row[:] for row in self.panel], self.floor[:])
+
     def __str__(self):
         result = f"{self.score}"
         for row in range(SETTINGS.ROWS):
@@ -146,8 +184,10 @@ class GameState:
         if self.player_boards is None: self.player_boards = [PlayerState(self.advanced) for i in range(self.n_players)]
         if self.batches is None: self.batches = [DCounter({color: 0 for color in Tile.color_tiles()}) for i in range(SETTINGS.N_BATCHES[self.n_players])]
     
-    def copy(self):
-        return dataclasses.replace(self)
+    def copy(self):  # Copies everything that play() can change; random_state is an immutable tuple and Tiles are enum members, so those are shared rather than deep copied
+        return GameState(self.n_players, self.advanced, self.random_state, self.turn,
+            [board.copy() for board in self.player_boards], [DCounter(batch) for batch in self.batches], DCounter(self.bench),
+            None if self.supply is None else DCounter(self.supply), None if self.discard is None else DCounter(self.discard))
 
     def visible(self):
         return dataclasses.replace(self, random_state=None, supply=None, discard=None)
@@ -201,73 +241,193 @@ class GameState:
 
 
 class Game:
-    def __init__(self, state: GameState):
+    def __init__(self, state: GameState, record_undo=False):  # Only games made with record_undo can unplay(); the rest don't pay for keeping the history
         self._state = state
+        self.record_undo = record_undo
+        self._undo_stack = []  # With record_undo, one entry per move played, holding just what that move changed (plus a full copy if it ended the round)
+        self._rgen = random.Random()  # Kept in sync with random_state lazily; see _random()
+        self._rgen_state = None
+        self.profile = None  # See enable_profiling()
+        self._recount()
+
+    def _recount(self):  # Rebuilds the counters that play() and _score_round() keep up to date incrementally
+        self._tiles_on_table = self._count_tiles_on_table()
+        self._panel_row_fills = self._count_panel_row_fills()
+        self._full_rows = self._panel_row_fills.count(SETTINGS.COLS)
+        self._position_hash = self._compute_hash()
+
+    def _count_tiles_on_table(self):  # Full scan of the batches and bench, including the first player tile
+        return sum(sum(batch.values()) for batch in self._state.batches)+sum(self._state.bench.values())
+
+    def _count_panel_row_fills(self):  # Full scan of how many tiles are in each panel row, ROWS entries per player
+        return [sum(1 for tile in row if tile.iscolor) for player in self._state.player_boards for row in player.panel]
+
+    def _compute_hash(self):  # Full scan for position_hash, which play() otherwise keeps up to date
+        state = self._state
+        h = ZOBRIST_TURN[state.turn]
+        for source_id, source in enumerate([state.bench]+state.batches):
+            keys = ZOBRIST_SOURCES[source_id]
+            h ^= keys[0][source[Tile.FIRST]]
+            for tile in COLOR_TILES: h ^= keys[tile][source[tile]]
+        for p, player in enumerate(state.player_boards):
+            h ^= zobrist_score(p, player.score)
+            for row in range(SETTINGS.ROWS): h ^= ZOBRIST_STAGES[p][row][max(player.stage_contents[row], 0)][player.stage_fullnesses[row]]
+            h ^= ZOBRIST_FLOORS[p][0][player.floor.count(Tile.FIRST)]
+            for tile in COLOR_TILES: h ^= ZOBRIST_FLOORS[p][tile][player.floor.count(tile)]
+            for cell, tile in enumerate(tile for row in player.panel for tile in row):
+                if tile.iscolor: h ^= ZOBRIST_PANELS[p][cell][tile]
+        return h
+
+    def _check_counters(self):
+        assert self._tiles_on_table == self._count_tiles_on_table(), f"{self._tiles_on_table} tiles on the table are counted, but there are {self._count_tiles_on_table()}"
+        assert self._panel_row_fills == self._count_panel_row_fills(), f"Panel rows are counted as {self._panel_row_fills}, but are {self._count_panel_row_fills()}"
+        assert self._full_rows == self._panel_row_fills.count(SETTINGS.COLS)
     
     @classmethod
-    def _empty_game(cls, n_players, advanced, random_seed=None):
+    def _empty_game(cls, n_players, advanced, random_seed=None, record_undo=False):
         random_state = random.Random(random_seed).getstate()
         state = GameState(n_players, advanced, random_state)
-        return cls(state)
+        return cls(state, record_undo)
     
     @classmethod
-    def new_game(cls, n_players, advanced, random_seed=None):
-        game = cls._empty_game(n_players, advanced, random_seed)
+    def new_game(cls, n_players, advanced, random_seed=None, record_undo=False):
+        game = cls._empty_game(n_players, advanced, random_seed, record_undo)
         game._craft()
+        game._position_hash = game._compute_hash()
         return game
     
     def _resupply(self):
-        self._state.supply += self._state.discard
+        self._state.supply.update(self._state.discard)  # Unlike +=, update() keeps empty colors in place, so the order the supply is drawn from stays the same
         self._state.discard.clear()
     
-    def _draw(self):
-        rgen = random.Random()
-        rgen.setstate(self._state.random_state)
-        supply_elements = list(self._state.supply.elements())
-        tile = supply_elements[rgen.randrange(len(supply_elements))]
-        self._state.supply[tile] -= 1
-        self._state.random_state = rgen.getstate()
-        return tile
+    def _random(self):  # A live generator at random_state, only re-hydrated when random_state has been replaced (e.g. by restore()) since the last _craft()
+        if self._rgen_state is not self._state.random_state:
+            self._rgen.setstate(self._state.random_state)
+            self._rgen_state = self._state.random_state
+        return self._rgen
+
+    def _draw(self, rgen, supply_size):  # Draws a tile weighted by how many of each color are in the supply, without listing the supply out; gives the same tile as picking from the supply's elements in color order
+        i = rgen.randrange(supply_size)
+        for tile in COLOR_TILES:
+            n = self._state.supply[tile]
+            if i < n:
+                self._state.supply[tile] = n-1
+                return tile
+            i -= n
 
     def _craft(self):
         self._state.bench[Tile.FIRST] += 1
+        self._tiles_on_table += 1
+        rgen = self._random()
+        supply_size = sum(self._state.supply.values())
         for batch in self._state.batches:
             for _ in range(SETTINGS.TILES_PER_BATCH):
-                if sum(self._state.supply.values()) == 0:
-                    if sum(self._state.discard.values()) == 0:  # Discard is empty -> cannot resupply
+                if supply_size == 0:
+                    supply_size = sum(self._state.discard.values())
+                    if supply_size == 0:  # Discard is empty -> cannot resupply
+                        self._state.random_state = self._rgen_state = rgen.getstate()
                         return
                     else:
                         self._resupply()
-                batch[self._draw()] += 1
+                batch[self._draw(rgen, supply_size)] += 1
+                supply_size -= 1
+                self._tiles_on_table += 1
+        self._state.random_state = self._rgen_state = rgen.getstate()
     
     def play(self, move):
         valid, error = self.check(move)
         if not valid: raise error
-        self._state.turn = (self._state.turn + 1) % self._state.n_players
         player = self._state.player_boards[move.player_id]
         source = self._state.bench if move.source_id == 0 else self._state.batches[move.source_id-1]
+        undo = None if not self.record_undo else (move, self._state.turn, DCounter(source), None if move.source_id == 0 else DCounter(self._state.bench), len(player.floor),
+            None if move.dest_id == 0 else (player.stage_contents[move.dest_id-1], player.stage_fullnesses[move.dest_id-1]), self._tiles_on_table, self._position_hash)
+        h = self._position_hash ^ ZOBRIST_TURN[self._state.turn]
+        self._state.turn = (self._state.turn + 1) % self._state.n_players
+        h ^= ZOBRIST_TURN[self._state.turn]
+        source_keys = ZOBRIST_SOURCES[move.source_id]
+        floor_keys = ZOBRIST_FLOORS[move.player_id]
         n_tiles = source[move.tile]
+        n_floor = player.floor.count(move.tile)
         source[move.tile] = 0
+        h ^= source_keys[move.tile][n_tiles] ^ source_keys[move.tile][0]
+        self._tiles_on_table -= n_tiles
         if move.source_id == 0:
             if source[Tile.FIRST] > 0:
                 source[Tile.FIRST] -= 1
                 player.floor.append(Tile.FIRST)
+                self._tiles_on_table -= 1
+                h ^= source_keys[0][1] ^ source_keys[0][0] ^ floor_keys[0][0] ^ floor_keys[0][1]
         else:
+            bench_keys = ZOBRIST_SOURCES[0]
+            for tile in COLOR_TILES:
+                n = source[tile]
+                if n > 0: h ^= source_keys[tile][n] ^ source_keys[tile][0] ^ bench_keys[tile][self._state.bench[tile]] ^ bench_keys[tile][self._state.bench[tile]+n]
             self._state.bench += source
             source.clear()
         if move.dest_id == 0:
             player.floor += [move.tile for i in range(n_tiles)]
+            h ^= floor_keys[move.tile][n_floor] ^ floor_keys[move.tile][n_floor+n_tiles]
         else:
+            stage_keys = ZOBRIST_STAGES[move.player_id][move.dest_id-1]
+            h ^= stage_keys[max(player.stage_contents[move.dest_id-1], 0)][player.stage_fullnesses[move.dest_id-1]]
             if player.stage_fullnesses[move.dest_id-1]+n_tiles > move.dest_id:
                 overflow = player.stage_fullnesses[move.dest_id-1]+n_tiles-move.dest_id
                 player.floor += [move.tile for i in range(overflow)]
                 n_tiles -= overflow
+                h ^= floor_keys[move.tile][n_floor] ^ floor_keys[move.tile][n_floor+overflow]
             player.stage_contents[move.dest_id-1] = move.tile
             player.stage_fullnesses[move.dest_id-1] += n_tiles
-        
+            h ^= stage_keys[move.tile][player.stage_fullnesses[move.dest_id-1]]
+        self._position_hash = h
+
         if self._tiling_finished():
+            if undo is not None: self._undo_stack.append(undo+(self._state.copy(),))
             self._end_round()
+            self._position_hash = self._compute_hash()
+        elif undo is not None:
+            self._undo_stack.append(undo+(None,))
+
+    def unplay(self):  # Takes back the last move played
+        if not self.record_undo: raise IllegalGameOperationError("This game doesn't record moves to take back; make it with record_undo=True.")
+        if len(self._undo_stack) == 0: raise IllegalGameOperationError("There is no move to take back.")
+        move, turn, source, bench, floor_length, stage, tiles_on_table, position_hash, round_state = self._undo_stack.pop()
+        if round_state is not None:
+            self._state = round_state.copy()  # Copied because snapshots share undo entries
+            self._recount()
+        self._tiles_on_table = tiles_on_table
+        self._position_hash = position_hash
+        self._state.turn = turn
+        if move.source_id == 0:
+            self._state.bench = DCounter(source)
+        else:
+            self._state.batches[move.source_id-1] = DCounter(source)
+            self._state.bench = DCounter(bench)
+        player = self._state.player_boards[move.player_id]
+        del player.floor[floor_length:]
+        if stage is not None:
+            player.stage_contents[move.dest_id-1], player.stage_fullnesses[move.dest_id-1] = stage
+
+    def snapshot(self):  # An independent copy of the game's state, counters and undo history that restore() can return to any number of times
+        return self._state.copy(), list(self._undo_stack), (self._tiles_on_table, self._panel_row_fills[:], self._full_rows, self._position_hash)
+
+    def restore(self, snapshot):
+        state, undo_stack, (self._tiles_on_table, panel_row_fills, self._full_rows, self._position_hash) = snapshot
+        self._state = state.copy()
+        self._undo_stack = list(undo_stack)
+        self._panel_row_fills = panel_row_fills[:]
     
+    def enable_profiling(self, profile=None):  # Starts counting the time, calls and net memory blocks of each of this game's phases; pass a profiling.Profile to share one between games. Returns the Profile
+        if self.profile is not None: self.profile.detach(self)
+        self.profile = profile if profile is not None else profiling.Profile()
+        self.profile.attach(self)
+        return self.profile
+
+    def disable_profiling(self):  # Back to no overhead at all; returns the Profile, whose numbers are kept
+        profile = self.profile
+        if profile is not None: profile.detach(self)
+        self.profile = None
+        return profile
+
     def check(self, move):
         if move.player_id != self._state.turn: return False, IllegalGameOperationError(f"It is player {self._state.turn}'s turn, not Player {move.player_id}'s.")
         if (self._state.bench if move.source_id == 0 else self._state.batches[move.source_id-1])[move.tile] == 0: return False, IllegalGameOperationError(f"No {move.tile} in {self.format_source(move.source_id, capitalize=True)}.")
@@ -275,17 +435,37 @@ class Game:
             player = self._state.player_boards[move.player_id]
             if move.tile in player.panel[move.dest_id-1]: return False, IllegalGameOperationError(f"Panel row {move.dest_id} already contains {move.tile}.")
             if player.stage_contents[move.dest_id-1] not in (move.tile, Tile.NONE): return False, IllegalGameOperationError(f"Cannot add {move.tile} to {player.stage_contents[move.dest_id-1]} stage.")
-        return True, ImpossibleGameFlowError("This error should not be thrown")
+        return True, NO_ERROR
+
+    def iter_legal_moves(self):  # Yields the encode_move() code of every valid move for the player whose turn it is, without going through check()
+        state = self._state
+        if state.turn < 0: return
+        player = state.player_boards[state.turn]
+        stride = SETTINGS.ROWS+1
+        open_rows = {}  # For each color, the codes (minus the source and color part) of the stages that color may go to
+        for source_id, source in enumerate([state.bench]+state.batches):
+            for color, tile in enumerate(COLOR_TILES):
+                if source[tile] == 0: continue
+                if tile not in open_rows:
+                    open_rows[tile] = [0]+[row+1 for row in range(SETTINGS.ROWS) if player.stage_contents[row] in (tile, Tile.NONE) and tile not in player.panel[row]]
+                base = (source_id*len(COLOR_TILES)+color)*stride
+                for dest_id in open_rows[tile]:
+                    yield base+dest_id
+
+    def legal_moves(self, key=None):  # Like iter_legal_moves(), but as a list, optionally sorted by key (called with each code) for move ordering
+        moves = list(self.iter_legal_moves())
+        if key is not None: moves.sort(key=key)
+        return moves
     
     def _game_over(self):
-        for player in self._state.player_boards:
-            for row in player.panel:
-                if all([tile.iscolor for tile in row]):
-                    return True
-        return False
-    
-    def _tiling_finished(self):
-        return all([sum(batch.values()) == 0 for batch in self._state.batches]) and (sum(self._state.bench.values()) == 0)
+        if debug: self._check_counters()
+        return self._full_rows > 0
+
+    def _tiling_finished(self):  # Called by play() once the move is made, when the counters and position hash should be up to date
+        if debug:
+            self._check_counters()
+            assert self._position_hash == self._compute_hash(), "The position hash is out of date"
+        return self._tiles_on_table == 0
     
     def _end_round(self):
         first_player = -1
@@ -305,7 +485,7 @@ class Game:
         self._state.turn = first_player
 
     def _score_round(self):  # Move over and discard tiles and score points
-        for player in self._state.player_boards:
+        for p, player in enumerate(self._state.player_boards):
             # Move tiles over
             for row in range(SETTINGS.ROWS):
                 content = player.stage_contents[row]
@@ -323,6 +503,8 @@ class Game:
                     else:
                         player.panel[row][dest_id-1] = content
                         player.score += self._score_tile(player.panel, row, dest_id-1)
+                        self._panel_row_fills[p*SETTINGS.ROWS+row] += 1
+                        if self._panel_row_fills[p*SETTINGS.ROWS+row] == SETTINGS.COLS: self._full_rows += 1
             
             # Score the floor
             for i in range(min(len(player.floor), len(SETTINGS.PENALTIES))):
@@ -337,23 +519,23 @@ class Game:
             for row in range(SETTINGS.ROWS):
                 fullness = player.stage_fullnesses[row]
                 if fullness == row+1:
+                    self._state.discard[player.stage_contents[row]] += fullness-1  # We discard all of the tiles but the one going onto the panel
                     player.stage_fullnesses[row] = 0
                     player.stage_contents[row] = Tile.NONE
-                    self._state.discard[content] += fullness-1  # We discard all of the tiles but the one going onto the panel
             for tile in player.floor:
-                self._state.discard[tile] += 1
+                if tile.iscolor: self._state.discard[tile] += 1  # The first player tile goes back to the bench in _craft rather than into the supply
             player.floor = []
     
     @classmethod
-    def _score_tile(cls, panel, row, col):
+    def _score_tile(cls, panel, row, col):  # Looks the tile's runs up in scoring's tables from the occupancy of its row and column
+        from simulation import scoring  # scoring imports this module, so it's imported here rather than at the top
         assert panel[row][col] is not Tile.NONE
-        extents = {direction: cls._contiguous(panel, row, col, direction) for direction in Direction}
-        horizontal = extents[Direction.LEFT]+extents[Direction.RIGHT]-1  # We count the active tile in each direction and only want it counted once
-        vertical = extents[Direction.UP]+extents[Direction.DOWN]-1
-        return horizontal+vertical-(1 if (horizontal == 1 or vertical == 1) else 0)  # If there are linkages in both directions, just add them up. If there are linkages in only one or none of the directions, subtract one from this sum.
+        row_bits = sum(1 << c for c, tile in enumerate(panel[row]) if tile is not Tile.NONE)
+        column_bits = sum(1 << r for r in range(SETTINGS.ROWS) if panel[r][col] is not Tile.NONE)
+        return scoring.LINKS[scoring.RUNS[row_bits][col]][scoring.RUNS[column_bits][row]]
 
     @classmethod
-    def _contiguous(cls, panel, row, col, direction):  # Recursively determines how many tiles are non-NONE in a particular direction
+    def _contiguous(cls, panel, row, col, direction):  # Recursively determines how many tiles are non-NONE in a particular direction; scoring checks its tables against this
         if row < 0 or row >= SETTINGS.ROWS or col < 0 or col >= SETTINGS.COLS: return 0
         if panel[row][col] is Tile.NONE: return 0
         movers = {Direction.LEFT: lambda row, col: (row, col-1),
@@ -396,6 +578,22 @@ class Game:
     def view(self):
         return self._state.visible()
 
+    @property
+    def turn(self):  # Whose turn it is, without copying the state
+        return self._state.turn
+
+    @property
+    def scores(self):
+        return [board.score for board in self._state.player_boards]
+
+    @property
+    def position_hash(self):  # 64-bit Zobrist hash of everything players can see, kept up to date by play() and unplay()
+        return self._position_hash
+
+    @property
+    def tiles_on_table(self):  # Goes up only when a move ends the round and the next one is crafted
+        return self._tiles_on_table
+
     def __str__(self):
         return str(self._state)
 
@@ -406,7 +604,7 @@ def main():
     # print(g)
     g._resupply()
     # print(g)
-    print(g._draw())
+    print(g._draw(g._random(), sum(g._state.supply.values())))
     # print(g)
     g._craft()
     print(g)
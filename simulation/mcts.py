@@ -0,0 +1,199 @@
+from simulation.game import Game, DCounter, SETTINGS, COLOR_TILES, decode_move
+from simulation.compact import CompactGame
+from simulation.player import Player
+from simulation.policy import random_policy, play_policy
+from simulation.symmetry import distinct_moves
+import multiprocessing
+import random
+import math
+import time
+
+# Monte Carlo Tree Search. Players can't see the supply, the discard or random_state, so every iteration plays out a determinization:
+# the unseen tiles all go to the supply (where they are drawn from first) and random_state is freshly seeded.
+# Nothing hidden matters until a round ends, so the tree covers the rest of the current round, which plays out the same in every determinization,
+# and anything past the end of the round is left to rollouts.
+
+ITERATIONS = 200  # Default budget when neither iterations nor time_limit is given
+EXPLORATION = 0.7  # UCT exploration constant, for rewards between 0 and 1
+MARGIN_SCALE = 10  # Score margin that makes a reward of about 0.73
+
+class Node:  # With a transposition table, a node is shared by every move order that reaches its position
+    __slots__ = ("mover", "children", "untried", "round_over", "visits", "value")
+
+    def __init__(self, mover=-1, round_over=False):
+        self.mover = mover  # Who made the move into this node, whose reward value totals
+        self.children = {}  # By encode_move() code
+        self.untried = None  # Codes of legal moves not expanded yet; filled in on the first visit
+        self.round_over = round_over  # The move ended the round (or game), so what follows depends on the determinization and is only ever rolled out
+        self.visits = 0
+        self.value = 0.0
+
+    def select(self, exploration):  # The (code, child) pair with the best UCT score
+        log_visits = math.log(self.visits)
+        return max(self.children.items(), key=lambda item: item[1].value/item[1].visits+exploration*math.sqrt(log_visits/item[1].visits))
+
+def rewards(scores):  # Each player's reward in [0, 1] for their score margin over the best of the others
+    result = []
+    for p, score in enumerate(scores):
+        margin = score-max(s for q, s in enumerate(scores) if q != p)
+        result.append(1/(1+math.exp(-margin/MARGIN_SCALE)))
+    return result
+
+def unseen_tiles(view):  # Tiles that are in the supply or the discard, neither of which players can see
+    tiles = DCounter(SETTINGS.INVENTORY)
+    for source in view.batches+[view.bench]:
+        for tile in COLOR_TILES: tiles[tile] -= source[tile]
+    for board in view.player_boards:
+        for tile, n in zip(board.stage_contents, board.stage_fullnesses):
+            if tile.iscolor: tiles[tile] -= n
+        for row in board.panel:
+            for tile in row:
+                if tile.iscolor: tiles[tile] -= 1
+        for tile in board.floor:
+            if tile.iscolor: tiles[tile] -= 1
+    return tiles
+
+
+class Search:  # One player's search tree, which can be carried over to later turns
+    def __init__(self, rgen, exploration=EXPLORATION, rollout_rounds=1, engine=CompactGame, table=None, rollout_policy=random_policy):
+        self.rgen = rgen
+        self.rollout_policy = rollout_policy  # One of the simulation.policy policies
+        self.table = table  # A TranspositionTable of nodes by position_hash, which may be shared with other searches
+        self.exploration = exploration
+        self.rollout_rounds = rollout_rounds  # Rollouts stop once this many rounds have ended (counting one that ended inside the tree), or at the end of the game
+        self.engine = engine
+        self.root = None
+        self.root_view = None
+
+    def reset(self, view):
+        self.root = Node()
+        self.root_view = view
+
+    def advance(self, views):  # Moves the root down the moves that led through views; starts over unless each was a move already in the tree that did not end the round
+        node, previous = self.root, self.root_view
+        if node is None: return False
+        for view in views:
+            if view == previous: continue
+            for code, child in node.children.items():
+                if child.round_over: continue
+                g = Game(previous.copy())
+                g.play(decode_move(code, previous.turn))
+                if g.view == view: break
+            else:
+                return False
+            node, previous = child, view
+        self.root, self.root_view = node, previous
+        return True
+
+    def _determinize(self):
+        state = self.root_view.copy()
+        state.supply = unseen_tiles(self.root_view)
+        state.discard = DCounter({tile: 0 for tile in COLOR_TILES})
+        state.random_state = random.Random(self.rgen.getrandbits(64)).getstate()
+        return self.engine(state)
+
+    def run(self, iterations=None, time_limit=None):  # Runs until either budget runs out; at least one iteration is always run
+        if iterations is None and time_limit is None: iterations = ITERATIONS
+        deadline = None if time_limit is None else time.perf_counter()+time_limit
+        i = 0
+        while True:
+            self._iterate()
+            i += 1
+            if iterations is not None and i >= iterations: return i
+            if deadline is not None and time.perf_counter() >= deadline: return i
+
+    def _iterate(self):
+        g = self._determinize()
+        node = self.root
+        path = [node]
+        while node.untried is not None and len(node.untried) == 0 and len(node.children) > 0:  # Selection
+            code, node = node.select(self.exploration)
+            g.play(decode_move(code, g.turn))
+            path.append(node)
+        rounds = 1 if node.round_over else 0
+        if not node.round_over and g.turn >= 0:  # Expansion
+            if node.untried is None:
+                node.untried = distinct_moves(g._state, g.legal_moves())  # Moves from identical batches would only grow the tree with copies
+                self.rgen.shuffle(node.untried)
+            code = node.untried.pop()
+            mover, table = g.turn, g.tiles_on_table
+            g.play(decode_move(code, mover))
+            round_over = g.turn < 0 or g.tiles_on_table > table
+            node = None if round_over or self.table is None else self.table.get(g.position_hash)  # Positions after the end of the round differ between determinizations, so those are never shared
+            if node is None:
+                node = Node(mover, round_over)
+                if not round_over and self.table is not None: self.table.put(g.position_hash, node)
+            path[-1].children[code] = node
+            path.append(node)
+            if round_over: rounds += 1
+        result = self._rollout(g, rounds)
+        for node in path:  # Backpropagation
+            node.visits += 1
+            if node.mover >= 0: node.value += result[node.mover]
+
+    def _rollout(self, g, rounds):
+        while g.turn >= 0 and rounds < self.rollout_rounds:
+            table = g.tiles_on_table
+            play_policy(g, self.rollout_policy, self.rgen)
+            if g.tiles_on_table > table: rounds += 1
+        return rewards(g.scores)
+
+    def root_stats(self):  # {code: (visits, value)} for each move from the root
+        return {code: (child.visits, child.value) for code, child in self.root.children.items()}
+
+def _search_worker(args):  # Runs one independent search for root parallelism
+    view, seed, iterations, time_limit, exploration, rollout_rounds, engine, rollout_policy = args  # Workers don't share a transposition table
+    search = Search(random.Random(seed), exploration, rollout_rounds, engine, rollout_policy=rollout_policy)
+    search.reset(view)
+    search.run(iterations, time_limit)
+    return search.root_stats()
+
+
+class MCTSPlayer(Player):  # Picks the most visited move after searching for the given number of iterations or seconds, whichever runs out first
+    def __init__(self, player_id, n_players, random_seed=None, iterations=None, time_limit=None, exploration=EXPLORATION, rollout_rounds=1, reuse_tree=True, processes=1, engine=CompactGame, table=None, rollout_policy=random_policy):
+        super().__init__(player_id, n_players)
+        self.rgen = random.Random(random_seed)
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.reuse_tree = reuse_tree
+        self.processes = processes  # More than one runs that many independent searches at once and adds up their root statistics; each gets the whole budget
+        self.search = Search(self.rgen, exploration, rollout_rounds, engine, table, rollout_policy)
+        self.game_state = None
+        self._views = []  # Views since the search's root, to find the moves played in between
+        self._pool = None
+
+    def update(self, view):
+        view = view.copy()  # Game.view shares its boards and batches with the live game, so a view kept for later would change under us
+        self.game_state = view
+        if self.reuse_tree and self.processes <= 1 and (len(self._views) == 0 or self._views[-1] != view): self._views.append(view)  # Parallel searches start over every move, so they have no use for views
+
+    def play(self, validator):
+        view = self.game_state
+        assert view is not None and view.turn == self.player_id, f"It is not Player {self.player_id}'s turn"
+        if self.processes > 1:
+            self._views = []
+            stats = self._parallel_stats(view)
+        else:
+            if self.search.table is not None: self.search.table.new_search()
+            if not (self.reuse_tree and self.search.advance(self._views)): self.search.reset(view)
+            self._views = []
+            self.search.run(self.iterations, self.time_limit)
+            stats = self.search.root_stats()
+        if len(stats) == 0: return decode_move(self.rgen.choice(Game(view).legal_moves()), self.player_id)
+        return decode_move(max(stats, key=lambda code: stats[code][0]), self.player_id)
+
+    def _parallel_stats(self, view):
+        if self._pool is None: self._pool = multiprocessing.Pool(self.processes)
+        search = self.search
+        tasks = [(view, self.rgen.getrandbits(64), self.iterations, self.time_limit, search.exploration, search.rollout_rounds, search.engine, search.rollout_policy) for _ in range(self.processes)]
+        stats = {}
+        for worker_stats in self._pool.map(_search_worker, tasks):
+            for code, (visits, value) in worker_stats.items():
+                total = stats.get(code, (0, 0.0))
+                stats[code] = (total[0]+visits, total[1]+value)
+        return stats
+
+    def close(self):  # Shuts down the worker processes, if any
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
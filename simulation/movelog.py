@@ -0,0 +1,126 @@
+from array import array
+import struct
+import sys
+from simulation.game import encode_move, decode_move
+from simulation.compact import CompactGame
+
+# Append-only move logs. A game is fully determined by its settings, its seed and the encode_move() code of every ply, so that is all a log stores.
+# A log's binary form is a header "<BBBqI": format version, n_players, advanced, seed, number of moves; then the codes as little-endian uint16s.
+# A log file is just such records end to end: finished games are appended with one write each, and read_logs() streams them back.
+
+FORMAT = 1
+HEADER = struct.Struct("<BBBqI")
+CHECKPOINT_EVERY = 16  # Plies between the snapshots a Replay keeps
+
+class MoveLog:
+    def __init__(self, n_players, advanced, seed, moves=()):
+        if not isinstance(seed, int): raise TypeError(f"Move logs need an integer seed, not {seed!r}.")
+        self.n_players = n_players
+        self.advanced = advanced
+        self.seed = seed
+        self.moves = array("H", moves)  # encode_move() codes, one per ply
+
+    def append(self, move):
+        self.moves.append(encode_move(move))
+
+    def __len__(self):
+        return len(self.moves)
+
+    def new_game(self, engine=CompactGame, record_undo=False):
+        return engine.new_game(self.n_players, self.advanced, random_seed=self.seed, record_undo=record_undo)
+
+    def replay(self, ply=None, engine=CompactGame):  # The game after the first ply moves (all of them if ply is None), played straight through from the start
+        game = self.new_game(engine)
+        for code in self.moves[:ply]:
+            game.play(decode_move(code, game.turn))
+        return game
+
+    def to_bytes(self):
+        moves = array("H", self.moves)
+        if sys.byteorder == "big": moves.byteswap()
+        return HEADER.pack(FORMAT, self.n_players, self.advanced, self.seed, len(moves))+moves.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        log, _ = cls._unpack_from(data)
+        return log
+
+    @classmethod
+    def _unpack_from(cls, data, offset=0):  # The log starting at offset, and the offset just past it
+        fmt, n_players, advanced, seed, n_moves = HEADER.unpack_from(data, offset)
+        if fmt != FORMAT: raise ValueError(f"Expected a format {FORMAT} move log, not {fmt}.")
+        offset += HEADER.size
+        log = cls(n_players, bool(advanced), seed)
+        log.moves.frombytes(data[offset:offset+2*n_moves])
+        if sys.byteorder == "big": log.moves.byteswap()
+        return log, offset+2*n_moves
+
+    def __eq__(self, other):
+        return isinstance(other, MoveLog) and (self.n_players, self.advanced, self.seed, self.moves) == (other.n_players, other.advanced, other.seed, other.moves)
+
+def write_logs(logs, file):  # file is opened in binary mode; returns how many logs were written
+    n = 0
+    for log in logs:
+        file.write(log.to_bytes())
+        n += 1
+    return n
+
+def read_logs(file, chunk_size=1 << 20):  # Yields every log in a binary file, reading it in chunks of about chunk_size bytes rather than all at once
+    buffer = b""
+    offset = 0
+    while True:
+        while len(buffer)-offset >= HEADER.size:
+            n_moves = HEADER.unpack_from(buffer, offset)[-1]
+            if len(buffer)-offset < HEADER.size+2*n_moves: break
+            log, offset = MoveLog._unpack_from(buffer, offset)
+            yield log
+        chunk = file.read(chunk_size)
+        if not chunk:
+            if offset < len(buffer): raise ValueError("The file ends partway through a move log.")
+            return
+        buffer = buffer[offset:]+chunk
+        offset = 0
+
+
+class Replay:  # Rebuilds any ply of a logged game from the nearest snapshot rather than from move 0
+    def __init__(self, log, engine=CompactGame, checkpoint_every=CHECKPOINT_EVERY):
+        self.log = log
+        self.checkpoint_every = checkpoint_every
+        self._game = log.new_game(engine, record_undo=True)  # For stepping back a few moves in seek()
+        self._ply = 0
+        self._checkpoints = [self._game.snapshot()]  # _checkpoints[i] is the game after i*checkpoint_every plies; added as replaying first reaches them
+
+    @property
+    def ply(self):
+        return self._ply
+
+    def seek(self, ply):  # The game after the first ply moves. It is shared and changed by the next seek(), so copy its state rather than playing on it
+        if not 0 <= ply <= len(self.log): raise IndexError(f"Ply {ply} is not in this {len(self.log)} move game.")
+        i = min(ply//self.checkpoint_every, len(self._checkpoints)-1)
+        if ply < self._ply and self._ply-ply <= ply-i*self.checkpoint_every:  # Taking a few moves back is quicker than replaying from the checkpoint
+            while self._ply > ply:
+                self._game.unplay()
+                self._ply -= 1
+        elif ply < self._ply or i*self.checkpoint_every > self._ply:
+            self._game.restore(self._checkpoints[i])
+            self._ply = i*self.checkpoint_every
+        while self._ply < ply:
+            self._play_next()
+        return self._game
+
+    def _play_next(self):
+        self._game.play(decode_move(self.log.moves[self._ply], self._game.turn))
+        self._ply += 1
+        if self._ply == len(self._checkpoints)*self.checkpoint_every: self._checkpoints.append(self._game.snapshot())
+
+    def state(self, ply):
+        return self.seek(ply).state
+
+    def view(self, ply):
+        return self.seek(ply).view
+
+    def plies(self):  # Yields (ply, game before that ply's move, the move) for the whole game in order; the game is shared as in seek()
+        game = self.seek(0)
+        while self._ply < len(self.log):
+            yield self._ply, game, decode_move(self.log.moves[self._ply], game.turn)
+            if self._ply < len(self.log): self._play_next()
@@ -1,5 +1,6 @@
 from simulation import game
 from typing import Callable, Tuple, List
+import random
 
 class Player:
     def __init__(self, player_id, n_players):
@@ -15,6 +16,18 @@ class Player:
     def tile(self, validator: Callable[[game.MoveOver], Tuple[bool, game.Error]]) -> List[game.MoveOver]:  # Gets called in advanced gameplay to determine how the player moves over their tiles onto the panel
         raise NotImplementedError
 
+class RandomPlayer(Player):  # Plays a uniformly random legal move
+    def __init__(self, player_id, n_players, random_seed=None):
+        super().__init__(player_id, n_players)
+        self.rgen = random.Random(random_seed)
+        self.game_state = None
+
+    def update(self, view):
+        self.game_state = view
+
+    def play(self, validator):
+        return game.decode_move(self.rgen.choice(game.Game(self.game_state).legal_moves()), self.player_id)
+
 class TextInputPlayer(Player):
     def __init__(self, player_id, n_players, print_updates=True):
         super().__init__(player_id, n_players)
@@ -0,0 +1,150 @@
+from simulation.game import Tile, SETTINGS, COLOR_TILES, decode_move
+from simulation.compact import CompactState, SLOTS, COLORS, FIRST, PATTERN_COLS
+from simulation.player import Player
+from simulation import scoring
+from collections import namedtuple
+import random
+
+# Cheap move policies, for computer players and for MCTS rollouts.
+# A MoveEvaluator reads the mover's panel mask, stages and floor once per position. After that, each candidate move's outcome is a few table lookups:
+# the points its stage would score when _score_round moves it over (if the move fills it) and the floor penalty it adds. Nothing is rescored.
+# Outcomes are for the basic pattern; advanced games can't be scored yet anyway.
+
+Outcome = namedtuple("Outcome", ("points", "penalty", "placed", "floored"))  # placed counts tiles that go onto the stage and floored those that go onto the floor, including the first player tile
+PENALTY_TOTALS = tuple(sum(SETTINGS.PENALTIES[:n]) for n in range(sum(SETTINGS.INVENTORY.values())+2))  # PENALTY_TOTALS[n] is the penalty for a floor of n tiles; no floor can be longer
+STRIDE = SETTINGS.ROWS+1
+
+class MoveEvaluator:
+    def __init__(self, sources, stage_contents, stage_fullnesses, panel_mask, floor_length):
+        self.sources = sources  # SLOTS counts (as in CompactState) per source, bench first
+        self.stage_contents = stage_contents  # The mover's, as tile values
+        self.stage_fullnesses = stage_fullnesses
+        self.panel_mask = panel_mask
+        self.floor_length = floor_length
+
+    @classmethod
+    def from_state(cls, state):  # Evaluates the moves of whoever's turn it is in a GameState (or a view) or a CompactState
+        if state.advanced: raise NotImplementedError("Need to write this part still")
+        p, rows = state.turn, SETTINGS.ROWS
+        if isinstance(state, CompactState):
+            batches = state.batches
+            return cls([state.bench[:]]+[batches[i:i+SLOTS] for i in range(0, len(batches), SLOTS)], state.stage_contents[p*rows:(p+1)*rows],
+                state.stage_fullnesses[p*rows:(p+1)*rows], state.panel_masks[p], len(state.floors[p]))
+        board = state.player_boards[p]
+        return cls([[source[Tile.FIRST]]+[source[tile] for tile in COLOR_TILES] for source in [state.bench]+state.batches], [tile.value for tile in board.stage_contents],
+            board.stage_fullnesses, scoring.panel_mask(board.panel), len(board.floor))
+
+    @classmethod
+    def from_game(cls, game):  # Reads the game's own state, without the copy that game.state makes
+        return cls.from_state(game._state)
+
+    def legal_moves(self):  # Same codes as Game.iter_legal_moves(), in the same order
+        open_rows = [None]*SLOTS
+        moves = []
+        for source_id, counts in enumerate(self.sources):
+            for color in COLORS:
+                if counts[color] == 0: continue
+                dests = open_rows[color]
+                if dests is None:
+                    dests = open_rows[color] = [0]+[row+1 for row in range(SETTINGS.ROWS) if self.stage_contents[row] in (color, 0) and not (self.panel_mask >> (row*SETTINGS.COLS+PATTERN_COLS[row][color-1])) & 1]
+                code = (source_id*len(COLORS)+color-1)*STRIDE
+                moves.extend(code+dest_id for dest_id in dests)
+        return moves
+
+    def outcome(self, code):
+        rest, dest_id = divmod(code, STRIDE)
+        source_id, color = divmod(rest, len(COLORS))
+        color += 1
+        counts = self.sources[source_id]
+        n = counts[color]
+        floored = 1 if source_id == 0 and counts[FIRST] > 0 else 0
+        placed = 0
+        points = 0
+        if dest_id == 0:
+            floored += n
+        else:
+            row = dest_id-1
+            fullness = self.stage_fullnesses[row]
+            placed = min(n, dest_id-fullness)
+            floored += n-placed
+            if placed > 0 and fullness+placed == dest_id:  # Only the move that fills the stage earns its points; into a stage that's already full, every tile goes to the floor
+                col = PATTERN_COLS[row][color-1]
+                points = scoring.score_tile(self.panel_mask | (1 << (row*SETTINGS.COLS+col)), row, col)
+        return Outcome(points, PENALTY_TOTALS[self.floor_length+floored]-PENALTY_TOTALS[self.floor_length], placed, floored)
+
+    def outcomes(self):  # (code, points, penalty, placed, floored) for every legal move, in legal_moves() order; much cheaper than outcome() on each
+        floor_length = self.floor_length
+        base_penalty = PENALTY_TOTALS[floor_length]
+        open_rows = [None]*SLOTS  # For each color, (dest_id, room, points if filled) for the stages it may go to
+        result = []
+        for source_id, counts in enumerate(self.sources):
+            first = 1 if source_id == 0 and counts[FIRST] > 0 else 0
+            for color in COLORS:
+                n = counts[color]
+                if n == 0: continue
+                dests = open_rows[color]
+                if dests is None:
+                    dests = open_rows[color] = []
+                    for row in range(SETTINGS.ROWS):
+                        bit = 1 << (row*SETTINGS.COLS+PATTERN_COLS[row][color-1])
+                        if self.stage_contents[row] in (color, 0) and not self.panel_mask & bit:
+                            dests.append((row+1, row+1-self.stage_fullnesses[row], scoring.score_tile(self.panel_mask | bit, row, PATTERN_COLS[row][color-1])))
+                code = (source_id*len(COLORS)+color-1)*STRIDE
+                result.append((code, 0, PENALTY_TOTALS[floor_length+first+n]-base_penalty, 0, first+n))
+                for dest_id, room, points in dests:
+                    if n < room: result.append((code+dest_id, 0, PENALTY_TOTALS[floor_length+first]-base_penalty, n, first))
+                    elif room == 0: result.append((code+dest_id, 0, PENALTY_TOTALS[floor_length+first+n]-base_penalty, 0, first+n))  # Already full, so it scores the same whatever is played
+                    else: result.append((code+dest_id, points, PENALTY_TOTALS[floor_length+first+n-room]-base_penalty, room, first+n-room))
+        return result
+
+    def score(self, code):  # Net points the move is worth by the end of the round, all else being equal
+        points, penalty, _, _ = self.outcome(code)
+        return points-penalty
+
+
+def random_policy(evaluator, rgen):
+    return rgen.choice(evaluator.legal_moves())
+
+def greedy_policy(evaluator, rgen):  # Most net points, then the most tiles onto stages; ties are broken at random
+    best, best_key = [], None
+    for code, points, penalty, placed, _ in evaluator.outcomes():
+        key = (points-penalty, placed)
+        if best_key is None or key > best_key: best, best_key = [code], key
+        elif key == best_key: best.append(code)
+    return rgen.choice(best)
+
+def floor_policy(evaluator, rgen):  # Fewest tiles onto the floor, then the most net points and tiles onto stages
+    best, best_key = [], None
+    for code, points, penalty, placed, floored in evaluator.outcomes():
+        key = (-floored, points-penalty, placed)
+        if best_key is None or key > best_key: best, best_key = [code], key
+        elif key == best_key: best.append(code)
+    return rgen.choice(best)
+
+POLICIES = {"random": random_policy, "greedy": greedy_policy, "floor": floor_policy}
+
+def play_policy(game, policy, rgen):  # Plays one move of the policy's choosing; for rollouts
+    code = policy(MoveEvaluator.from_game(game), rgen)
+    game.play(decode_move(code, game.turn))
+    return code
+
+
+class PolicyPlayer(Player):  # Plays whatever its policy picks in each position
+    policy = staticmethod(random_policy)
+
+    def __init__(self, player_id, n_players, random_seed=None):
+        super().__init__(player_id, n_players)
+        self.rgen = random.Random(random_seed)
+        self.game_state = None
+
+    def update(self, view):
+        self.game_state = view
+
+    def play(self, validator):
+        return decode_move(self.policy(MoveEvaluator.from_state(self.game_state), self.rgen), self.player_id)
+
+class GreedyPlayer(PolicyPlayer):
+    policy = staticmethod(greedy_policy)
+
+class FloorMinimizingPlayer(PolicyPlayer):
+    policy = staticmethod(floor_policy)
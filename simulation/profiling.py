@@ -0,0 +1,92 @@
+import time
+import json
+import sys
+import weakref
+
+# Opt-in instrumentation for Game. Attaching a Profile to a game wraps that one game's phase methods in timers. Nothing is wrapped until then, so games without a profile run exactly as fast as before.
+# Times are inclusive: play() includes the check() and _end_round() it calls, and _end_round() includes _score_round(), _score_bonuses() and _craft().
+# net_blocks is the change in sys.getallocatedblocks() over each call: the blocks each phase leaves allocated, not every allocation it makes. The count is process-wide, so other threads' allocations and frees during a call are in it too, and it can go negative.
+
+PHASES = ("check", "play", "_craft", "_end_round", "_score_round", "_score_bonuses")
+PROMETHEUS_PREFIX = "iznik_game"
+
+class Profile:  # Cumulative numbers for every game it is attached to; attach one per game for per-game numbers, or share one to add games up
+    def __init__(self, phases=PHASES):
+        self.phases = tuple(phases)
+        self.calls = dict.fromkeys(self.phases, 0)
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        self.net_blocks = dict.fromkeys(self.phases, 0)
+        self.games = 0  # Distinct games it has been attached to
+        self._counted = weakref.WeakSet()  # Those games, while they last, so attaching one again doesn't count it again
+
+    def attach(self, game):
+        if any(getattr(game.__dict__.get(phase), "profile", None) is self for phase in self.phases): return  # Already attached; wrapping again would count every call twice
+        for phase in self.phases:
+            setattr(game, phase, self._wrap(phase, getattr(game, phase)))  # The instance attribute shadows the class's method, including for the game's calls to itself
+        if game not in self._counted:
+            self._counted.add(game)
+            self.games += 1
+
+    def detach(self, game):
+        for phase in self.phases:
+            game.__dict__.pop(phase, None)
+
+    def _wrap(self, phase, method):
+        calls, seconds, net_blocks = self.calls, self.seconds, self.net_blocks
+        clock, allocated = time.perf_counter, sys.getallocatedblocks
+        def timed(*args):
+            start_blocks = allocated()
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                seconds[phase] += clock()-start
+                calls[phase] += 1
+                net_blocks[phase] += allocated()-start_blocks
+        timed.profile = self
+        return timed
+
+    def merge(self, other):  # Adds other's numbers into this one's
+        for phase in other.phases:
+            if phase not in self.calls:
+                self.phases += (phase,)
+                self.calls[phase], self.seconds[phase], self.net_blocks[phase] = 0, 0.0, 0
+            self.calls[phase] += other.calls[phase]
+            self.seconds[phase] += other.seconds[phase]
+            self.net_blocks[phase] += other.net_blocks[phase]
+        self.games += other.games
+        return self
+
+    def reset(self):
+        for phase in self.phases:
+            self.calls[phase], self.seconds[phase], self.net_blocks[phase] = 0, 0.0, 0
+
+    def to_dict(self):
+        return {"games": self.games, "phases": {phase: {"calls": self.calls[phase], "seconds": self.seconds[phase], "net_blocks": self.net_blocks[phase]} for phase in self.phases}}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    def to_prometheus(self, labels=None, prefix=PROMETHEUS_PREFIX, headers=True):  # Prometheus text exposition format; labels (like {"game": id}) are added to every sample
+        return to_prometheus([(labels or {}, self)], prefix, headers)
+
+def _label_text(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def to_prometheus(labeled_profiles, prefix=PROMETHEUS_PREFIX, headers=True):  # One exposition for many (labels, Profile) pairs, e.g. one per game
+    metrics = (
+        ("phase_calls_total", "counter", "Calls of each game phase", lambda profile, phase: profile.calls[phase]),
+        ("phase_seconds_total", "counter", "Seconds spent in each game phase, including the phases it calls", lambda profile, phase: profile.seconds[phase]),
+        ("phase_net_blocks", "gauge", "Net change in the process's allocated memory blocks over each game phase, which can be negative", lambda profile, phase: profile.net_blocks[phase]))  # Can go down, so not a counter
+    lines = []
+    for name, kind, description, value in metrics:
+        if headers:
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, profile in labeled_profiles:
+            for phase in profile.phases:
+                lines.append(f"{prefix}_{name}{{{_label_text(dict(labels, phase=phase.lstrip('_')))}}} {value(profile, phase)}")
+    return "\n".join(lines)+"\n"
@@ -0,0 +1,141 @@
+from simulation.game import Game, GameState, PlayerState, Tile, Direction, SETTINGS, COLOR_TILES
+import itertools
+
+# Table-driven scoring on panel bitmasks. A panel's occupancy is one int with bit row*COLS+col set for every cell that holds a tile.
+# The score for placing a tile depends only on the occupancy of its row and its column, so it comes from lookup tables instead of walking the panel.
+# score_tiles_many and score_bonuses_many do the same lookups with NumPy over whole arrays of panels at once. Only they need NumPy, which they import on first use.
+# Run this module to check every lookup against walking the panel with Game._contiguous and against Game._score_bonuses.
+
+ROWS, COLS = SETTINGS.ROWS, SETTINGS.COLS
+LINE = max(ROWS, COLS)
+FULL_ROW = (1 << COLS)-1
+FULL_COLUMN = (1 << ROWS)-1
+N_COLOR = min(ROWS, COLS)  # The number of tiles of one color that earns the color bonus
+
+def _run(bits, i):  # Length of the run of set bits through bit i
+    if not (bits >> i) & 1: return 0
+    left = i
+    while left > 0 and (bits >> (left-1)) & 1: left -= 1
+    right = i
+    while right < LINE-1 and (bits >> (right+1)) & 1: right += 1
+    return right-left+1
+
+RUNS = tuple(tuple(_run(bits, i) for i in range(LINE)) for bits in range(1 << LINE))  # RUNS[bits][i] is the length of the run of tiles through position i of a line
+LINKS = tuple(tuple(h+v-(1 if (h == 1 or v == 1) else 0) for v in range(ROWS+1)) for h in range(COLS+1))  # LINKS[horizontal][vertical] is the score for a tile with those run lengths, as in Game._score_tile
+POPCOUNT = tuple(bin(bits).count("1") for bits in range(1 << LINE))
+BASIC_COLOR_MASKS = tuple(sum(1 << (row*COLS+SETTINGS.BASIC_PATTERN[row].index(tile)) for row in range(ROWS)) for tile in COLOR_TILES)  # The cells each color goes to in the basic pattern
+
+def panel_mask(panel):  # Works on both a GameState panel (a list of rows) and a CompactState panel (flat and row-major)
+    cells = panel if len(panel) == ROWS*COLS else [tile for row in panel for tile in row]
+    mask = 0
+    for i, tile in enumerate(cells):
+        if tile > 0: mask |= 1 << i
+    return mask
+
+def color_masks(panel):  # One mask per color of where that color is on the panel; only needed in advanced games, where colors can go anywhere
+    cells = panel if len(panel) == ROWS*COLS else [tile for row in panel for tile in row]
+    masks = [0]*len(COLOR_TILES)
+    for i, tile in enumerate(cells):
+        if tile > 0: masks[tile-1] |= 1 << i
+    return tuple(masks)
+
+def row_bits(mask, row):
+    return (mask >> (row*COLS)) & FULL_ROW
+
+def column_bits(mask, col):
+    bits = 0
+    for row in range(ROWS):
+        bits |= ((mask >> (row*COLS+col)) & 1) << row
+    return bits
+
+def score_tile(mask, row, col):  # Same as Game._score_tile for a panel whose occupancy (including the new tile) is mask
+    return LINKS[RUNS[row_bits(mask, row)][col]][RUNS[column_bits(mask, col)][row]]
+
+def score_bonuses(mask, colors=BASIC_COLOR_MASKS):  # Same as one player's share of Game._score_bonuses
+    full_columns = FULL_ROW
+    score = 0
+    for row in range(ROWS):
+        bits = row_bits(mask, row)
+        if bits == FULL_ROW: score += SETTINGS.BONUSES.HORIZONTAL
+        full_columns &= bits
+    score += POPCOUNT[full_columns]*SETTINGS.BONUSES.VERTICAL
+    for color_mask in colors:
+        if bin(mask & color_mask).count("1") == N_COLOR: score += SETTINGS.BONUSES.COLOR
+    return score
+
+_arrays = None
+
+def _numpy():  # NumPy and the lookup tables as arrays, made on first use
+    global _arrays
+    if _arrays is None:
+        import numpy as np
+        _arrays = (np, np.array(RUNS), np.array(LINKS), np.array(POPCOUNT), np.array(BASIC_COLOR_MASKS, dtype=np.int64))
+    return _arrays
+
+def score_tiles_many(masks, rows, cols):  # score_tile over arrays of masks, rows and cols, which broadcast against each other
+    np, runs, links, _, _ = _numpy()
+    masks, rows, cols = np.asarray(masks, dtype=np.int64), np.asarray(rows), np.asarray(cols)
+    column = sum(((masks >> (row*COLS+cols)) & 1) << row for row in range(ROWS))
+    return links[runs[(masks >> (rows*COLS)) & FULL_ROW, cols], runs[column, rows]]
+
+def score_bonuses_many(masks, colors=None):  # score_bonuses over an array of masks; colors, if given, has shape masks.shape+(number of colors,)
+    np, _, _, popcount, basic_colors = _numpy()
+    masks = np.asarray(masks, dtype=np.int64)
+    colors = masks[..., None] & (basic_colors if colors is None else np.asarray(colors, dtype=np.int64))
+    scores = np.zeros(masks.shape, dtype=np.int64)
+    full_columns = np.full(masks.shape, FULL_ROW)
+    color_counts = np.zeros(colors.shape, dtype=np.int64)
+    for row in range(ROWS):
+        bits = (masks >> (row*COLS)) & FULL_ROW
+        scores += np.where(bits == FULL_ROW, SETTINGS.BONUSES.HORIZONTAL, 0)
+        full_columns &= bits
+        color_counts += popcount[(colors >> (row*COLS)) & FULL_ROW]
+    scores += popcount[full_columns]*SETTINGS.BONUSES.VERTICAL
+    scores += (color_counts == N_COLOR).sum(axis=-1)*SETTINGS.BONUSES.COLOR
+    return scores
+
+def _panel_from_mask(mask):  # A basic-pattern GameState panel with the cells of mask filled in
+    return [[(SETTINGS.BASIC_PATTERN[row][col] if (mask >> (row*COLS+col)) & 1 else Tile.NONE) for col in range(COLS)] for row in range(ROWS)]
+
+def _walked_score(panel, row, col):  # The score for the tile at (row, col) found by walking the panel from it, as Game did before it used these tables
+    horizontal = Game._contiguous(panel, row, col, Direction.LEFT)+Game._contiguous(panel, row, col, Direction.RIGHT)-1
+    vertical = Game._contiguous(panel, row, col, Direction.UP)+Game._contiguous(panel, row, col, Direction.DOWN)-1
+    return horizontal+vertical-(1 if (horizontal == 1 or vertical == 1) else 0)
+
+def check_equivalence(n_bonus_panels=20000, random_seed=0):
+    import random
+    # score_tile only looks at the tile's row and column, so trying every row and column occupancy through every cell covers all panels
+    placements = []
+    for row, col in itertools.product(range(ROWS), range(COLS)):
+        for r_bits, c_bits in itertools.product(range(1 << COLS), range(1 << ROWS)):
+            if not (r_bits >> col) & 1 or not (c_bits >> row) & 1: continue
+            mask = (r_bits << (row*COLS))
+            for r in range(ROWS):
+                if (c_bits >> r) & 1: mask |= 1 << (r*COLS+col)
+            panel = _panel_from_mask(mask)
+            expected = _walked_score(panel, row, col)
+            assert score_tile(mask, row, col) == expected, (mask, row, col)
+            assert Game._score_tile(panel, row, col) == expected, (mask, row, col)
+            placements.append((mask, row, col, expected))
+    masks, rows, cols, expected = zip(*placements)
+    assert score_tiles_many(masks, rows, cols).tolist() == list(expected)
+    print(f"score_tile and score_tiles_many match walking the panel on all {len(placements)} row/column occupancies")
+
+    # Bonuses depend on the whole panel, so check every row and column pattern of full lines plus random panels
+    rgen = random.Random(random_seed)
+    masks = [rgen.getrandbits(ROWS*COLS) | rgen.choice([0, FULL_ROW << (COLS*rgen.randrange(ROWS)), BASIC_COLOR_MASKS[rgen.randrange(len(BASIC_COLOR_MASKS))]]) for _ in range(n_bonus_panels)]
+    masks += [sum(FULL_ROW << (row*COLS) for row in range(ROWS) if (rows >> row) & 1) | sum(1 << (row*COLS+col) for row in range(ROWS) for col in range(COLS) if (cols >> col) & 1) for rows in range(1 << ROWS) for cols in range(1 << COLS)]
+    boards = [PlayerState(False, panel=_panel_from_mask(mask)) for mask in masks]
+    players = max(SETTINGS.N_BATCHES)  # Games only have keys (for position_hash) for this many players, so the boards are scored a game's worth at a time
+    for i in range(0, len(boards), players):
+        chunk = boards[i:i+players]
+        Game(GameState(len(chunk), False, None, player_boards=chunk, batches=[]))._score_bonuses()
+    expected = [board.score for board in boards]
+    assert [score_bonuses(mask) for mask in masks] == expected
+    assert score_bonuses_many(masks).tolist() == expected
+    assert score_bonuses_many(masks, [color_masks(board.panel) for board in boards]).tolist() == expected
+    print(f"score_bonuses matches Game._score_bonuses on {len(masks)} panels")
+
+
+if __name__ == "__main__":
+    check_equivalence()
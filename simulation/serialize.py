@@ -0,0 +1,172 @@
+from array import array
+import struct
+import json
+import sys
+from simulation.game import GameState, PlayerState, DCounter, Tile, SETTINGS
+from simulation.compact import CompactState, SLOTS, CELLS, TILES
+from simulation import scoring
+
+# Purpose-built encoders for GameState, instead of dataclasses.asdict (which deep copies everything first).
+# JSON (to_dict/to_json) is for clients. Tiles are their integer values and tile counts are objects keyed by tile value, leaving out zero counts:
+#   {"schema": 1, "n_players", "advanced", "turn", "player_boards": [{"advanced", "score", "stage_contents", "stage_fullnesses", "panel", "floor"}],
+#    "batches": [{"<tile>": count}], "bench": {"<tile>": count}, "random_state": [version, [ints], gauss] or null, "supply": {...} or null, "discard": {...} or null}
+# The binary form (to_bytes/from_bytes) is for storage and passing states between processes. It is the CompactState arrays laid end to end after a small header:
+#   header "<BBBbBB": format version, n_players, advanced, turn, flags (which of supply, discard and random_state follow), number of batches
+#   scores (int16 per player), stage_contents, stage_fullnesses and panels (int8), each floor as a length byte then int8 tiles,
+#   batches and bench (int8 counts, SLOTS per source), then supply and discard (SLOTS int8 each) and random_state (version byte, 625 uint32, gauss flag byte, double) if flagged
+# Bump SCHEMA or FORMAT whenever the layout changes.
+
+SCHEMA = 1
+FORMAT = 1
+HEADER = struct.Struct("<BBBbBB")
+HAS_SUPPLY = 1
+HAS_DISCARD = 2
+HAS_RANDOM_STATE = 4
+MT_WORDS = 625  # Length of the Mersenne Twister state in random.getstate()
+TILE_KEYS = {tile: str(tile.value) for tile in Tile}
+KEY_TILES = {key: tile for tile, key in TILE_KEYS.items()}
+
+def _counts_to_dict(counter):
+    return {TILE_KEYS[tile]: n for tile, n in counter.items() if n > 0}
+
+def _dict_to_counts(d):
+    return DCounter({KEY_TILES[key]: n for key, n in d.items()})
+
+def to_dict(state: GameState):
+    return {
+        "schema": SCHEMA,
+        "n_players": state.n_players,
+        "advanced": state.advanced,
+        "turn": state.turn,
+        "player_boards": [{
+            "advanced": board.advanced,
+            "score": board.score,
+            "stage_contents": [tile.value for tile in board.stage_contents],
+            "stage_fullnesses": list(board.stage_fullnesses),
+            "panel": [[tile.value for tile in row] for row in board.panel],
+            "floor": [tile.value for tile in board.floor]
+        } for board in state.player_boards],
+        "batches": [_counts_to_dict(batch) for batch in state.batches],
+        "bench": _counts_to_dict(state.bench),
+        "random_state": None if state.random_state is None else [state.random_state[0], list(state.random_state[1]), state.random_state[2]],
+        "supply": None if state.supply is None else _counts_to_dict(state.supply),
+        "discard": None if state.discard is None else _counts_to_dict(state.discard)
+    }
+
+def from_dict(d):
+    if d.get("schema") != SCHEMA: raise ValueError(f"Expected a schema {SCHEMA} game state, not {d.get('schema')}.")
+    return GameState(
+        n_players=d["n_players"],
+        advanced=d["advanced"],
+        random_state=None if d["random_state"] is None else (d["random_state"][0], tuple(d["random_state"][1]), d["random_state"][2]),
+        turn=d["turn"],
+        player_boards=[PlayerState(
+            advanced=board["advanced"],
+            score=board["score"],
+            stage_contents=[TILES[v] for v in board["stage_contents"]],
+            stage_fullnesses=list(board["stage_fullnesses"]),
+            panel=[[TILES[v] for v in row] for row in board["panel"]],
+            floor=[TILES[v] for v in board["floor"]]
+        ) for board in d["player_boards"]],
+        batches=[_dict_to_counts(batch) for batch in d["batches"]],
+        bench=_dict_to_counts(d["bench"]),
+        supply=None if d["supply"] is None else _dict_to_counts(d["supply"]),
+        discard=None if d["discard"] is None else _dict_to_counts(d["discard"]))
+
+def to_json(state: GameState):
+    return json.dumps(to_dict(state), separators=(",", ":"))
+
+def from_json(text):
+    return from_dict(json.loads(text))
+
+def _little_endian(values):  # Multi-byte arrays are stored little-endian whatever the platform
+    if sys.byteorder == "big": values.byteswap()
+    return values
+
+def to_bytes(state):  # Takes a GameState or a CompactState
+    if not isinstance(state, CompactState): state = CompactState.from_state(state)
+    flags = (HAS_SUPPLY if state.supply is not None else 0) | (HAS_DISCARD if state.discard is not None else 0) | (HAS_RANDOM_STATE if state.random_state is not None else 0)
+    parts = [HEADER.pack(FORMAT, state.n_players, state.advanced, state.turn, flags, len(state.batches)//SLOTS),
+        _little_endian(array("h", state.scores)).tobytes(), state.stage_contents.tobytes(), state.stage_fullnesses.tobytes(), state.panels.tobytes()]
+    for floor in state.floors:
+        parts.append(bytes((len(floor),)))
+        parts.append(floor.tobytes())
+    parts.append(state.batches.tobytes())
+    parts.append(state.bench.tobytes())
+    if state.supply is not None: parts.append(state.supply.tobytes())
+    if state.discard is not None: parts.append(state.discard.tobytes())
+    if state.random_state is not None:
+        version, words, gauss = state.random_state
+        parts.append(bytes((version,)))
+        parts.append(_little_endian(array("I", words)).tobytes())
+        parts.append(struct.pack("<Bd", gauss is not None, 0.0 if gauss is None else gauss))
+    return b"".join(parts)
+
+def from_bytes(data, compact=False):  # Returns a GameState, or a CompactState if compact is set
+    fmt, n_players, advanced, turn, flags, n_batches = HEADER.unpack_from(data)
+    if fmt != FORMAT: raise ValueError(f"Expected a format {FORMAT} game state, not {fmt}.")
+    offset = HEADER.size
+
+    def take(typecode, n):
+        nonlocal offset
+        result = array(typecode)
+        result.frombytes(data[offset:offset+n*result.itemsize])
+        offset += n*result.itemsize
+        return _little_endian(result) if result.itemsize > 1 else result
+
+    rows = SETTINGS.ROWS
+    scores = array("i", take("h", n_players))
+    stage_contents = take("b", n_players*rows)
+    stage_fullnesses = take("b", n_players*rows)
+    panels = take("b", n_players*CELLS)
+    floors = []
+    for _ in range(n_players):
+        n = data[offset]
+        offset += 1
+        floors.append(take("b", n))
+    batches = take("b", n_batches*SLOTS)
+    bench = take("b", SLOTS)
+    supply = take("b", SLOTS) if flags & HAS_SUPPLY else None
+    discard = take("b", SLOTS) if flags & HAS_DISCARD else None
+    random_state = None
+    if flags & HAS_RANDOM_STATE:
+        version = data[offset]
+        offset += 1
+        words = tuple(take("I", MT_WORDS))
+        has_gauss, gauss = struct.unpack_from("<Bd", data, offset)
+        random_state = (version, words, gauss if has_gauss else None)
+    state = CompactState(n_players, bool(advanced), random_state, turn, scores, stage_contents, stage_fullnesses, panels,
+        array("l", [scoring.panel_mask(panels[p*CELLS:(p+1)*CELLS]) for p in range(n_players)]), floors, batches, bench, supply, discard)
+    return state if compact else state.to_state()
+
+def diff(old, new):  # Operations that turn one to_dict() result into another: [path, value] sets the value at path and [path] deletes it; a path is a list of keys and indices
+    ops = []
+    _diff(old, new, [], ops)
+    return ops
+
+def _diff(old, new, path, ops):
+    if old == new: return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new: ops.append([path+[key]])
+        for key, value in new.items():
+            if key in old: _diff(old[key], value, path+[key], ops)
+            else: ops.append([path+[key], value])
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for i, (a, b) in enumerate(zip(old, new)):
+            _diff(a, b, path+[i], ops)
+    else:
+        ops.append([path, new])
+
+def patch(doc, ops):  # Applies diff() operations to doc in place and returns the result
+    for op in ops:
+        path = op[0]
+        if len(path) == 0:
+            doc = op[1]
+            continue
+        parent = doc
+        for key in path[:-1]:
+            parent = parent[key]
+        if len(op) == 1: del parent[path[-1]]
+        else: parent[path[-1]] = op[1]
+    return doc
@@ -0,0 +1,66 @@
+from simulation.game import Tile, COLOR_TILES, SETTINGS, ZOBRIST_SOURCES
+from simulation.compact import CompactState, SLOTS
+from array import array
+
+# Which batch is which doesn't matter: permuting state.batches gives a position that plays out exactly the same, with the moves' source IDs permuted to match.
+# The canonical form of a position has its batches sorted by their counts, so every permutation of a position has the same canonical form and canonical_hash.
+# An order is a list of original batch indices (from 0) in canonical order; moves convert between the two numberings with to_canonical() and to_original().
+# The bench is never permuted: it isn't interchangeable with a batch.
+# Identical batches (including empty ones) also make identical moves, so only the first of them needs searching; distinct_moves() drops the rest.
+
+STRIDE = len(COLOR_TILES)*(SETTINGS.ROWS+1)  # Codes per source ID
+
+def batch_counts(state):  # SLOTS counts (as in CompactState) per batch, from a GameState (or a view) or a CompactState
+    if isinstance(state, CompactState):
+        batches = state.batches
+        return [tuple(batches[i:i+SLOTS]) for i in range(0, len(batches), SLOTS)]
+    return [(batch[Tile.FIRST],)+tuple(batch[tile] for tile in COLOR_TILES) for batch in state.batches]
+
+def canonical_order(state):
+    counts = batch_counts(state)
+    return sorted(range(len(counts)), key=counts.__getitem__)
+
+def canonical_form(game, counts=None):  # (canonical_hash, order) for a Game or CompactGame, from its position_hash and batches without a full rehash; pass batch_counts() if you have them
+    if counts is None: counts = batch_counts(game._state)
+    order = sorted(range(len(counts)), key=counts.__getitem__)
+    h = game.position_hash
+    for i, j in enumerate(order):
+        if i == j: continue
+        keys = ZOBRIST_SOURCES[i+1]
+        for slot, (old, new) in enumerate(zip(counts[i], counts[j])):
+            if old != new: h ^= keys[slot][old] ^ keys[slot][new]
+    return h, order
+
+def canonical_hash(game):  # The position_hash of the game's canonical form
+    return canonical_form(game)[0]
+
+def canonicalize(state):  # (a copy of state with its batches in canonical order, the order)
+    order = canonical_order(state)
+    state = state.copy()
+    if isinstance(state, CompactState):
+        batches = state.batches
+        state.batches = array(batches.typecode, [n for i in order for n in batches[i*SLOTS:(i+1)*SLOTS]])
+    else:
+        state.batches = [state.batches[i] for i in order]
+    return state, order
+
+def to_original(code, order):  # The move in the original numbering of an encode_move() code in the canonical one
+    source_id, rest = divmod(code, STRIDE)
+    return code if source_id == 0 else (order[source_id-1]+1)*STRIDE+rest
+
+def to_canonical(code, order):
+    source_id, rest = divmod(code, STRIDE)
+    return code if source_id == 0 else (order.index(source_id-1)+1)*STRIDE+rest
+
+def duplicate_sources(state, counts=None):  # Source IDs of batches identical to an earlier batch
+    seen = set()
+    duplicates = set()
+    for source_id, batch in enumerate(batch_counts(state) if counts is None else counts, 1):
+        if batch in seen: duplicates.add(source_id)
+        else: seen.add(batch)
+    return duplicates
+
+def distinct_moves(state, codes):  # codes without the moves from batches identical to an earlier batch, which lead to the same positions (up to batch order) as that batch's
+    duplicates = duplicate_sources(state)
+    if len(duplicates) == 0: return codes
+    return [code for code in codes if code//STRIDE not in duplicates]
@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+# A fixed-size table of search results keyed by Game.position_hash, which any number of search players in a process can share.
+# Every hash maps to a bucket of two slots: one kept for the deepest result (unless it is from an earlier search) and one that the newest result always goes in.
+# The table never grows past its size, so memory stays bounded however long it is used.
+
+ENTRY_BYTES = 160  # Rough memory per slot, counting its key, entry tuple and value, for sizing tables by memory
+Entry = namedtuple("Entry", ("key", "depth", "generation", "value"))
+
+class TranspositionTable:
+    def __init__(self, max_entries=1 << 20, memory=None):  # memory, in bytes, overrides max_entries; either is rounded down to a power of two
+        if memory is not None: max_entries = memory//ENTRY_BYTES
+        n_buckets = 1
+        while n_buckets*4 <= max_entries: n_buckets *= 2
+        self._mask = n_buckets-1
+        self._slots = [None]*(2*n_buckets)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self):
+        return len(self._slots)
+
+    def new_search(self):  # Marks everything stored so far as old, so it is the first to be replaced
+        self.generation += 1
+
+    def get(self, key, default=None):
+        i = 2*(key & self._mask)
+        for entry in (self._slots[i], self._slots[i+1]):
+            if entry is not None and entry.key == key:
+                self.hits += 1
+                return entry.value
+        self.misses += 1
+        return default
+
+    def put(self, key, value, depth=0):  # depth is how much search went into value; deeper results are kept over shallower ones
+        i = 2*(key & self._mask)
+        deep = self._slots[i]
+        entry = Entry(key, depth, self.generation, value)
+        if deep is None or deep.key == key or deep.depth <= depth or deep.generation != self.generation:
+            self._slots[i] = entry
+            if self._slots[i+1] is not None and self._slots[i+1].key == key: self._slots[i+1] = None
+        else:
+            self._slots[i+1] = entry
+
+    def __contains__(self, key):
+        i = 2*(key & self._mask)
+        return any(entry is not None and entry.key == key for entry in (self._slots[i], self._slots[i+1]))
+
+    def __len__(self):
+        return sum(1 for entry in self._slots if entry is not None)
+
+    def clear(self):
+        self._slots = [None]*len(self._slots)
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,20 @@
+// Shared by the clients, and loaded as a plain script before them (see templates/react-base.html) rather than imported, as the pages have no module loader
+
+function applyDiff(doc, ops) {  // Applies operations from the server's simulation.serialize.diff() to doc in place and returns the result
+    for (let i = 0; i < ops.length; i++) {
+        const path = ops[i][0];
+        if (path.length == 0) {
+            doc = ops[i][1];
+            continue;
+        }
+        let parent = doc;
+        for (let j = 0; j < path.length-1; j++) {parent = parent[path[j]]};
+        if (ops[i].length == 1) {delete parent[path[path.length-1]]}
+        else {parent[path[path.length-1]] = ops[i][1]};
+    }
+    return doc;
+}
+
+function applyTextDiff(text: string, ops): string {  // Applies a stateTextDiff, which is a diff of the text's lines
+    return applyDiff(text.split("\n"), ops).join("\n");
+}
@@ -7,7 +7,7 @@ const debug = false;
 const nullLabel = "-";  // A text label for the "Select:" option in dropdown menus
 const labelToNull = (label) => (label === nullLabel ? null : label);
 const nullToLabel = (value) => (value === null ? nullLabel : value);
-const updateInterval = 1000;
+const updateInterval = 1000;  // Only used to poll when the browser can't receive server-sent events
 
 type GameState = {
     stateText: string
@@ -246,6 +246,11 @@ class StatusMsg extends React.Component<{msg: string, type: StatusType}, {}> {
 }
 
 class Game extends React.Component<{}, {gameState: GameState, stagedMove: Move, myPlayer: number | null, intervalID: number | null, status: string, statusType: StatusType}> {
+    eventSource: EventSource | null = null;
+    lastVersion: string | null = null;  // The version of the last state received, so that the server can answer with a diff from it (or nothing, if unchanged)
+    lastGameState: any = null;
+    lastStateText: string = "";
+
     constructor(props) {
         super(props);
         this.state = {
@@ -265,10 +270,12 @@ class Game extends React.Component<{}, {gameState: GameState, stagedMove: Move,
         this.pollServer = this.pollServer.bind(this);
         this.pollServerPlayer = this.pollServerPlayer.bind(this);
         this.receiveState = this.receiveState.bind(this);
+        this.receiveResponse = this.receiveResponse.bind(this);
         this.moveSent = this.moveSent.bind(this);
     }
 
     pollServerManually(): void {
+        this.lastVersion = null;  // Ask for the full state even if it hasn't changed
         this.setState({
             gameState: {
                 stateText: "Contacting server…"
@@ -293,17 +300,26 @@ class Game extends React.Component<{}, {gameState: GameState, stagedMove: Move,
         xhttp.setRequestHeader("Content-type", "application/json");
         xhttp.send(JSON.stringify({
             requestType: "stateText",
+            version: this.lastVersion,
             player: player
         }));
     }
 
     receiveState(xhttp) {
-        const response = JSON.parse(xhttp.response)
-        const gameState = JSON.parse(response.gameState)
+        this.receiveResponse(JSON.parse(xhttp.response));
+    }
+
+    receiveResponse(response) {
+        if (response.notModified) {return};
+        const gameState = response.gameStateDiff == null ? JSON.parse(response.gameState) : applyDiff(this.lastGameState, response.gameStateDiff);
+        const stateText = response.stateTextDiff == null ? response.stateText : applyTextDiff(this.lastStateText, response.stateTextDiff);
+        this.lastVersion = response.version;
+        this.lastGameState = gameState;
+        this.lastStateText = stateText;
         console.log(gameState)
         this.setState({
             gameState: {
-                stateText: response.stateText
+                stateText: stateText
             },
             status: response.status,
             statusType: response.statusType
@@ -349,16 +365,29 @@ class Game extends React.Component<{}, {gameState: GameState, stagedMove: Move,
     handlePlayerChange(event) {
         // console.log(true)
         const player = labelToNull(event.target.value)
+        this.lastVersion = null;  // Each player gets a different response
         this.setState({
             myPlayer: player
         });
 
+        if (this.eventSource != null) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         if (player == null) {
             clearInterval(this.state.intervalID);
             this.setState({
                 intervalID: null
             });
         }
+        else if (typeof EventSource !== "undefined") {  // The server pushes a new state whenever the game changes, starting with the current one
+            const receiveResponse = this.receiveResponse;
+            this.eventSource = new EventSource("/basic-cli/events?player="+player);
+            this.eventSource.onmessage = function(event) {
+                receiveResponse(JSON.parse(event.data));
+            };
+            return;
+        }
         else if (this.state.intervalID == null) {
             const intervalID = setInterval(this.pollServer, updateInterval);
             this.setState({
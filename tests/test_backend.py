@@ -0,0 +1,143 @@
+import pytest
+import time
+import json
+
+pytest.importorskip("flask")
+from flask import Flask
+from backend import basic_cli
+from backend.bots import BotScheduler, fallback_move
+from simulation.mcts import MCTSPlayer
+from simulation import serialize
+
+TURNS = 4  # Bot turns to wait for
+TIMEOUT = 60  # Seconds the test waits for them, in all
+
+@pytest.fixture
+def client(monkeypatch):  # Bots search a fixed number of iterations, with a timeout no loaded machine should reach, so whether they fall back doesn't depend on the clock
+    scheduler = BotScheduler(max_workers=1, timeout=TIMEOUT, processes=True)
+    monkeypatch.setattr(basic_cli, "bots", scheduler)
+    monkeypatch.setitem(basic_cli.BOTS, "mcts", lambda player_id, n_players: MCTSPlayer(player_id, n_players, random_seed=0, iterations=50))
+    app = Flask(__name__)
+    app.register_blueprint(basic_cli.bp)
+    yield app.test_client()
+    scheduler.shutdown()
+
+def test_store_comes_from_config(tmp_path):  # Importing the blueprint opens nothing; registering it opens the store the app's config names
+    assert basic_cli.store is None
+    app = Flask(__name__)
+    app.config["BASIC_CLI_STORE_PATH"] = str(tmp_path/"games.sqlite3")
+    app.register_blueprint(basic_cli.bp)
+    try:
+        assert basic_cli.store is not None and (tmp_path/"games.sqlite3").exists()
+    finally:
+        basic_cli.open_store(None)
+
+def test_mcts_bot_moves(client):  # Every bot turn is the bot's own move, played in a worker process, rather than a fallback
+    game_id = client.post("/basic-cli/games", json={"nPlayers": 2, "bots": {"1": "mcts"}}).get_json()["game"]
+    container = basic_cli.games.get(game_id)
+    try:
+        bot_turns = 0
+        deadline = time.monotonic()+TIMEOUT
+        while bot_turns < TURNS and time.monotonic() < deadline:
+            with container.lock:
+                view = container.game.view
+                move = fallback_move(view) if view.turn == 0 else None
+            if view.turn < 0: break
+            if move is None:
+                time.sleep(0.05)
+                continue
+            response = client.post("/basic-cli/play", json={"game": game_id, "player": 0, "tile": move.tile.symbol, "source": move.source_id, "dest": move.dest_id})
+            assert response.get_json()["success"]
+            bot_turns += 1
+            while container.game.view.turn == 1 and time.monotonic() < deadline: time.sleep(0.05)
+        assert bot_turns == TURNS
+        assert container.game.view.turn != 1
+        assert container.fallbacks == 0
+    finally:
+        basic_cli.games.remove(game_id)
+
+def test_closed_game_takes_no_moves(client, monkeypatch):  # A request that found the game just before it was evicted must not play on it or save over the store's copy
+    game_id = client.post("/basic-cli/games", json={"nPlayers": 2}).get_json()["game"]
+    container = basic_cli.games.get(game_id)
+    saved = []
+    container.store = type("Store", (), {"save": lambda self, game_id, record: saved.append(record)})()
+    basic_cli.games.remove(game_id)
+    monkeypatch.setattr(basic_cli, "find_game", lambda game_id: container)
+    with container.lock: move = fallback_move(container.game.view)
+    response = client.post("/basic-cli/play", json={"game": game_id, "player": 0, "tile": move.tile.symbol, "source": move.source_id, "dest": move.dest_id})
+    assert response.status_code == 409 and response.get_json()["retry"]
+    assert len(container.log) == 0
+    container.save()
+    assert saved == []
+
+def test_state_diffs(client):  # A client that sends the version it has gets diffs of the state and its text that rebuild the full response
+    game_id = client.post("/basic-cli/games", json={"nPlayers": 2}).get_json()["game"]
+    container = basic_cli.games.get(game_id)
+    try:
+        ask = lambda version=None: client.post("/basic-cli/play", json={"game": game_id, "requestType": "stateText", "player": 0, "version": version}).get_json()
+        old = ask()
+        with container.lock: move = fallback_move(container.game.view)
+        client.post("/basic-cli/play", json={"game": game_id, "player": 0, "tile": move.tile.symbol, "source": move.source_id, "dest": move.dest_id})
+        diffed, full = ask(old["version"]), ask()
+        assert diffed["stateText"] is None and diffed["gameState"] is None
+        assert serialize.patch(json.loads(old["gameState"]), diffed["gameStateDiff"]) == json.loads(full["gameState"])
+        lines = serialize.patch(old["stateText"].split("\n"), diffed["stateTextDiff"])
+        assert lines[0] == basic_cli.timestamp() or lines[0] == full["stateText"].split("\n")[0]  # The timestamp line is always sent
+        assert lines[1:] == full["stateText"].split("\n")[1:]
+        assert len(json.dumps(diffed["stateTextDiff"])) < len(full["stateText"])
+    finally:
+        basic_cli.games.remove(game_id)
+
+def test_joined_seats_need_their_token(client, tmp_path):  # Join hands out a token that /play then wants for that seat, and the token outlives a restart; seats nobody joined stay open
+    basic_cli.open_store(str(tmp_path/"games.sqlite3"))
+    try:
+        game_id = client.post("/basic-cli/games", json={"nPlayers": 3}).get_json()["game"]
+        seat = client.post(f"/basic-cli/games/{game_id}/join", json={"player": 0}).get_json()
+        assert seat["player"] == 0 and client.post(f"/basic-cli/games/{game_id}/join", json={"player": 0}).status_code == 409
+        basic_cli.store.flush()
+        basic_cli.games.remove(game_id)  # The next request replays it from the store
+        container = basic_cli.find_game(game_id)
+        send = lambda player, move, **fields: client.post("/basic-cli/play", json={"game": game_id, "player": player, "tile": move.tile.symbol, "source": move.source_id, "dest": move.dest_id, **fields})
+        with container.lock: move = fallback_move(container.game.view)
+        assert send(0, move).status_code == 403 and send(0, move, token="wrong").status_code == 403 and send(0, move, token=None).status_code == 403
+        assert len(container.log) == 0
+        assert send(0, move, token=seat["token"]).get_json()["success"]
+        with container.lock: move = fallback_move(container.game.view)
+        assert send(1, move).get_json()["success"]
+        assert len(container.log) == 2
+    finally:
+        basic_cli.games.remove(game_id)
+        basic_cli.open_store(None)
+
+def test_bad_fields_are_rejected(client):  # Missing or malformed fields get a 400 rather than a server error
+    game_id = client.post("/basic-cli/games", json={"nPlayers": 2}).get_json()["game"]
+    container = basic_cli.games.get(game_id)
+    try:
+        with container.lock: move = fallback_move(container.game.view)
+        good = {"game": game_id, "player": 0, "tile": move.tile.symbol, "source": move.source_id, "dest": move.dest_id}
+        bad = [{"player": None}, {"player": "zero"}, {"player": 2}, {"player": True}, {"tile": "?"}, {"tile": 3}, {"source": "x"}, {"source": 99}, {"source": -1}, {"dest": None}, {"dest": 6}]
+        for fields in bad:
+            assert client.post("/basic-cli/play", json={**good, **fields}).status_code == 400, fields
+        for field in ("player", "tile", "source", "dest"):
+            assert client.post("/basic-cli/play", json={key: value for key, value in good.items() if key != field}).status_code == 400, field
+        assert client.post("/basic-cli/play", data="not json", content_type="application/json").status_code == 400
+        assert client.post("/basic-cli/play", json={"game": game_id, "requestType": "stateText", "player": "x"}).status_code == 400
+        assert client.post(f"/basic-cli/games/{game_id}/join", json={"player": "x"}).status_code == 400
+        assert client.get(f"/basic-cli/events?game={game_id}&player=9").status_code == 400
+        assert len(container.log) == 0
+        assert client.post("/basic-cli/play", json={**good, "player": "0", "source": str(move.source_id)}).get_json()["success"]  # Numbers as strings are still fine
+    finally:
+        basic_cli.games.remove(game_id)
+
+def test_unchanged_state_is_not_a_304(client):  # A POST for a version the client already has gets a 200 saying so, whether the version came in the body or as If-None-Match
+    game_id = client.post("/basic-cli/games", json={"nPlayers": 2}).get_json()["game"]
+    try:
+        ask = lambda version=None, **kwargs: client.post("/basic-cli/play", json={"game": game_id, "requestType": "stateText", "player": 0, "version": version}, **kwargs)
+        first = ask()
+        etag = first.headers["ETag"]
+        for response in (ask(first.get_json()["version"]), ask(headers={"If-None-Match": etag})):
+            assert response.status_code == 200 and response.get_json() == {"notModified": True, "version": first.get_json()["version"]}
+            assert response.headers["ETag"] == etag
+        assert ask(headers={"If-None-Match": '"other-0"'}).get_json()["gameState"] is not None
+    finally:
+        basic_cli.games.remove(game_id)
@@ -0,0 +1,25 @@
+from simulation import game
+from simulation.batch import play_game, run_batch
+from simulation.player import Player, RandomPlayer
+
+class FirstMovePlayer(Player):  # Plays its first legal move, and takes no random_seed
+    def __init__(self, player_id, n_players):
+        super().__init__(player_id, n_players)
+        self.view = None
+
+    def update(self, view):
+        self.view = view
+
+    def play(self, validator):
+        return game.decode_move(game.Game(self.view).legal_moves()[0], self.player_id)
+
+class KeywordPlayer(RandomPlayer):  # Passes its keywords, random_seed among them, on to RandomPlayer
+    def __init__(self, player_id, n_players, **kwargs):
+        super().__init__(player_id, n_players, **kwargs)
+
+def test_players_without_seeds():  # Classes that don't take random_seed still get seats, and the seeded ones are still reproducible
+    result = play_game(3, [FirstMovePlayer, RandomPlayer, "greedy"])
+    assert result.players == ["FirstMovePlayer", "RandomPlayer", "greedy"] and result.moves > 0
+    assert play_game(3, [FirstMovePlayer, RandomPlayer, "greedy"]) == result
+    assert play_game(3, [FirstMovePlayer, KeywordPlayer, "greedy"]).scores == result.scores  # **kwargs gets the seed too
+    assert len(list(run_batch(4, [FirstMovePlayer, FirstMovePlayer], processes=1))) == 4
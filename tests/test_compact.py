@@ -0,0 +1,38 @@
+from simulation.game import Game, COLOR_TILES, SETTINGS, decode_move
+from simulation.compact import CompactGame, CompactState
+import random
+import pytest
+
+@pytest.mark.parametrize("n_players", [2, 3, 4])
+def test_compact_matches_game(n_players):  # Given the same seed and moves, both engines offer the same moves and reach the same states, scores and hashes
+    for seed in range(4):
+        game, compact = Game.new_game(n_players, False, random_seed=seed), CompactGame.new_game(n_players, False, random_seed=seed)
+        rgen = random.Random(seed)
+        while True:
+            assert compact.state == game.state
+            assert compact.view == game.view
+            assert (compact.turn, compact.scores, compact.position_hash, compact.tiles_on_table) == (game.turn, game.scores, game.position_hash, game.tiles_on_table)
+            if game.turn < 0: break
+            codes = game.legal_moves()
+            assert compact.legal_moves() == codes
+            move = decode_move(rgen.choice(codes), game.turn)
+            for code in rgen.sample(range((1+len(game.view.batches))*len(COLOR_TILES)*(SETTINGS.ROWS+1)), 20):  # Both reject the same moves, too
+                other = decode_move(code, game.turn)
+                assert compact.check(other)[0] == game.check(other)[0]
+            game.play(move)
+            compact.play(move)
+        assert compact.view.winners == game.view.winners
+
+@pytest.mark.parametrize("n_players", [2, 3, 4])
+def test_state_round_trip(n_players):  # to_state() and from_state() lose nothing, at every ply of a game, hidden parts included
+    g = Game.new_game(n_players, False, random_seed=n_players)
+    rgen = random.Random(n_players)
+    while True:
+        state = g.state
+        compact = CompactState.from_state(state)
+        assert compact.to_state() == state
+        assert CompactState.from_state(compact.to_state()) == compact
+        assert compact.to_state(hidden=False) == g.view
+        assert CompactGame(state).position_hash == g.position_hash
+        if g.turn < 0: break
+        g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
@@ -0,0 +1,51 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactGame
+from simulation.endgame import Solver, round_end_scores, margin, _boards
+import random
+import pytest
+
+MAX_TILES = 6  # Small enough rounds to search by brute force
+
+def _brute_force(g, player_id):  # Plain minimax over the moves left in the round, actually playing each (round end included), for margins for player_id
+    mover = g.turn
+    best = None
+    for code in g.legal_moves():
+        g.play(decode_move(code, mover))
+        value = margin(g.scores, player_id) if g._undo_stack[-1][-1] is not None else _brute_force(g, player_id)  # A saved state marks a move that ended the round
+        g.unplay()
+        if best is None or (value > best if mover == player_id else value < best): best = value
+    return best
+
+def _late_positions(engine):  # Positions with at most MAX_TILES tiles left in the round, from seeded random games with 2 to 4 players
+    for seed in range(8):
+        g = engine.new_game(2+seed%3, False, random_seed=seed, record_undo=True)
+        rgen = random.Random(seed)
+        for _ in range(rgen.randrange(1, 3)*6):  # Into a later round, sometimes
+            if g.turn < 0: break
+            g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        while g.turn >= 0 and g.tiles_on_table > MAX_TILES: g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        if g.turn >= 0: yield g
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_solver_matches_brute_force(engine):  # The solved margin is the minimax one for every player, from the game or its view, and the move solved for achieves it
+    shared = Solver()  # Its table is kept between positions and players, so memo keys that mix them up show
+    n = 0
+    for g in _late_positions(engine):
+        for player_id in range(g.view.n_players):
+            expected = _brute_force(g, player_id)
+            assert Solver().solve(g, player_id).margin == expected
+            assert shared.solve(g, player_id).margin == expected
+        solution = Solver().solve(g.view)
+        assert solution.exact and solution.margin == _brute_force(g, g.turn)
+        g.play(solution.move)
+        if g._undo_stack[-1][-1] is None: assert _brute_force(g, g._undo_stack[-1][0].player_id) == solution.margin  # Playing on from the solved move keeps the margin
+        n += 1
+    assert n >= 4
+
+def test_round_end_scores():  # What the solver values leaves at is what the engine scores when the round really ends
+    for seed in range(10):
+        g = Game.new_game(2+seed%3, False, random_seed=seed, record_undo=True)
+        rgen = random.Random(seed)
+        while g.turn >= 0:
+            g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+            if g._undo_stack[-1][-1] is not None: assert round_end_scores(_boards(g._undo_stack[-1][-1])) == g.scores
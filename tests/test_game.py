@@ -0,0 +1,45 @@
+from simulation.game import Game, Tile, COLOR_TILES, SETTINGS, decode_move
+from simulation.compact import CompactGame
+import random
+import pytest
+
+def _tile_counts(state):  # How many of each tile are anywhere in the game
+    counts = {tile: 0 for tile in (Tile.FIRST,)+COLOR_TILES}
+    for counter in state.batches+[state.bench, state.supply, state.discard]:
+        for tile, n in counter.items(): counts[tile] += n
+    for board in state.player_boards:
+        for tile, n in zip(board.stage_contents, board.stage_fullnesses):
+            if n > 0: counts[tile] += n
+        for tile in [tile for row in board.panel for tile in row]+board.floor:
+            if tile is not Tile.NONE: counts[tile] += 1
+    return counts
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+@pytest.mark.parametrize("n_players", [2, 3, 4])
+def test_tiles_are_conserved(engine, n_players):  # Round ends discard full stages as their own color, and never put the first player tile in the supply or discard
+    expected = {**SETTINGS.INVENTORY, Tile.FIRST: 1}
+    for seed in range(3):
+        g = engine.new_game(n_players, False, random_seed=seed)
+        rgen = random.Random(seed)
+        while g.turn >= 0:
+            g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+            state = g.state
+            assert state.supply[Tile.FIRST] == 0 and state.discard[Tile.FIRST] == 0
+            if g.turn >= 0: assert _tile_counts(state) == expected
+
+def test_full_stage_discards_its_color():
+    g = Game._empty_game(2, False, random_seed=0)
+    board = g._state.player_boards[0]
+    board.stage_contents[1], board.stage_fullnesses[1] = Tile.CRIMSON, 2
+    board.floor.append(Tile.FIRST)
+    g._score_round()
+    assert g._state.discard == {Tile.CRIMSON: 1}
+    assert board.stage_contents[1] is Tile.NONE and board.stage_fullnesses[1] == 0
+
+def test_resupply_keeps_color_order():  # Even a color that ran out, and isn't in the discard, stays where it was in the supply
+    g = Game._empty_game(2, False, random_seed=0)
+    g._state.supply[Tile.AZUL] = 0
+    g._state.discard[Tile.BLAZE] += 1
+    g._resupply()
+    assert list(g._state.supply) == list(COLOR_TILES)
+    assert g._state.supply[Tile.BLAZE] == SETTINGS.INVENTORY[Tile.BLAZE]+1 and sum(g._state.discard.values()) == 0
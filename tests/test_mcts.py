@@ -0,0 +1,31 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactGame
+from simulation.mcts import MCTSPlayer
+from simulation.policy import GreedyPlayer
+import pytest
+
+ITERATIONS = 40
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_tree_reuse(engine):  # Game's views share state with the game, so the player has to keep copies for advance() to replay moves on
+    g = engine.new_game(2, False, random_seed=4)
+    players = [MCTSPlayer(0, 2, random_seed=0, iterations=ITERATIONS), GreedyPlayer(1, 2, random_seed=0)]
+    reused = 0
+    while g.turn >= 0:
+        view = g.view
+        for player in players: player.update(view)
+        move = players[g.turn].play(g.check)
+        if move.player_id == 0 and players[0].search.root.visits > ITERATIONS: reused += 1  # The root came with visits from earlier searches
+        g.play(move)
+    assert reused > 0
+
+def test_parallel_keeps_no_views():  # Only the single-process search reuses its tree, so only it needs the views in between
+    g = Game.new_game(2, False, random_seed=1)
+    player = MCTSPlayer(0, 2, random_seed=0, iterations=5, processes=2)
+    try:
+        for _ in range(6):
+            player.update(g.view)
+            g.play(player.play(g.check) if g.turn == 0 else decode_move(g.legal_moves()[0], g.turn))
+        assert player._views == []
+    finally:
+        player.close()
@@ -0,0 +1,65 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactGame
+from simulation.movelog import MoveLog, Replay, read_logs, write_logs, CHECKPOINT_EVERY
+import random
+import io
+import pytest
+
+def _log(n_players, seed):  # The log of a seeded random game
+    g = Game.new_game(n_players, False, random_seed=seed)
+    log = MoveLog(n_players, False, seed)
+    rgen = random.Random(seed)
+    while g.turn >= 0:
+        move = decode_move(rgen.choice(g.legal_moves()), g.turn)
+        g.play(move)
+        log.append(move)
+    return log
+
+LOGS = [_log(2, 0), _log(3, -2**63), _log(4, 2**63-1)]
+
+def test_bytes_round_trip():
+    for log in LOGS+[MoveLog(2, False, 5)]:
+        data = log.to_bytes()
+        assert len(data) == 15+2*len(log)  # The "<BBBqI" header, then two bytes a move
+        assert MoveLog.from_bytes(data) == log
+    data = bytearray(LOGS[0].to_bytes())
+    data[0] += 1
+    with pytest.raises(ValueError): MoveLog.from_bytes(bytes(data))
+    with pytest.raises(TypeError): MoveLog(2, False, None)
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_read_logs(chunk_size):  # Logs come back in order however the file is chunked
+    file = io.BytesIO()
+    assert write_logs(LOGS, file) == len(LOGS)
+    file.seek(0)
+    assert list(read_logs(file, chunk_size)) == LOGS
+    with pytest.raises(ValueError): list(read_logs(io.BytesIO(file.getvalue()[:-1]), chunk_size))
+
+def test_replay_plays_the_game():
+    log = LOGS[0]
+    g = Game.new_game(log.n_players, log.advanced, random_seed=log.seed)
+    for code in log.moves: g.play(decode_move(code, g.turn))
+    assert log.replay(engine=Game).state == g.state
+    assert log.replay().state == g.state
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_replay_seek(engine):  # Any ply, reached forward, backward, from a checkpoint or by taking moves back, matches playing the moves from the start
+    log = LOGS[1]
+    expected = [log.replay(ply, engine=Game).state for ply in range(len(log)+1)]
+    replay = Replay(log, engine)
+    boundaries = [ply for ply in range(0, len(log)+1, CHECKPOINT_EVERY)]
+    plies = [len(log), 0]+boundaries+[ply+offset for ply in boundaries for offset in (-1, 1, CHECKPOINT_EVERY//2)]+boundaries[::-1]
+    plies += [ply for boundary in boundaries for ply in (boundary+CHECKPOINT_EVERY//2+2, boundary+CHECKPOINT_EVERY//2)]  # Short steps back take moves back
+    plies += random.Random(0).choices(range(len(log)+1), k=50)
+    for ply in plies:
+        if not 0 <= ply <= len(log): continue
+        assert replay.state(ply) == expected[ply]
+        assert replay.ply == ply
+    with pytest.raises(IndexError): replay.seek(len(log)+1)
+
+def test_replay_plies():
+    log = LOGS[2]
+    replay = Replay(log)
+    for ply, game, move in replay.plies():
+        assert game.state == log.replay(ply).state
+        assert move == decode_move(log.moves[ply], game.turn)
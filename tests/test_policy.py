@@ -0,0 +1,39 @@
+from simulation.game import Game, Move, Tile, decode_move
+from simulation.compact import CompactGame
+from simulation.policy import MoveEvaluator
+import random
+import pytest
+
+def _full_stage_position(engine):  # Player 0 has filled their first stage with the color of one of the batches, and it's their turn again
+    g = engine.new_game(2, False, random_seed=0)
+    view = g.view
+    source_id, tile = next((i+1, tile) for i, batch in enumerate(view.batches) for tile in batch if tile.iscolor and batch[tile] > 0)
+    g.play(Move(0, tile, source_id, 1))
+    g.play(decode_move(next(code for code in g.legal_moves() if decode_move(code, 1).source_id != source_id and decode_move(code, 1).tile is not tile), 1))
+    return g, tile
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_move_into_full_stage_scores_nothing(engine):
+    g, tile = _full_stage_position(engine)
+    evaluator = MoveEvaluator.from_game(g)
+    codes = [code for code in g.legal_moves() if code % 6 == 1 and decode_move(code, 0).tile is tile]
+    assert len(codes) > 0
+    outcomes = {outcome[0]: outcome[1:] for outcome in evaluator.outcomes()}
+    for code in codes:
+        points, penalty, placed, floored = evaluator.outcome(code)
+        assert (points, placed) == (0, 0)
+        assert penalty > 0 and floored > 0
+        assert outcomes[code] == (points, penalty, placed, floored)
+        assert evaluator.score(code) == -penalty
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_outcomes_match_outcome(engine):  # The one-pass outcomes() agrees with outcome() move by move, through whole games
+    for seed in range(5):
+        g = engine.new_game(2+seed%3, False, random_seed=seed)
+        rgen = random.Random(seed)
+        while g.turn >= 0:
+            evaluator = MoveEvaluator.from_game(g)
+            outcomes = evaluator.outcomes()
+            assert [outcome[0] for outcome in outcomes] == g.legal_moves() == evaluator.legal_moves()
+            for code, *rest in outcomes: assert tuple(evaluator.outcome(code)) == tuple(rest)
+            g.play(decode_move(rgen.choice(outcomes)[0], g.turn))
@@ -0,0 +1,32 @@
+from simulation.game import Game, decode_move
+from simulation import profiling
+import random
+
+def _play(g, seed):  # Plays random moves to the end; returns how many
+    rgen = random.Random(seed)
+    moves = 0
+    while g.turn >= 0:
+        g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        moves += 1
+    return moves
+
+def test_games_are_counted_once():  # Attaching a profile again, even after detaching it, neither counts the game again nor times its calls twice
+    profile = profiling.Profile()
+    g, other = Game.new_game(2, False, random_seed=0), Game.new_game(2, False, random_seed=1)
+    profile.attach(g)
+    profile.attach(g)
+    g.enable_profiling(profile)
+    assert _play(g, 0) == profile.calls["play"]
+    assert profile.games == 1
+    profile.detach(g)
+    profile.attach(g)
+    profile.attach(other)
+    assert profile.games == 2
+    assert profiling.Profile().merge(profile).games == 2
+
+def test_net_blocks_are_reported():
+    g = Game.new_game(2, False, random_seed=0)
+    profile = g.enable_profiling()
+    _play(g, 0)
+    assert set(profile.to_dict()["phases"]["play"]) == {"calls", "seconds", "net_blocks"}
+    assert "iznik_game_phase_net_blocks{" in profile.to_prometheus()
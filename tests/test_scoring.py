@@ -0,0 +1,16 @@
+from simulation import scoring
+import random
+
+def test_check_equivalence():  # Scores thousands of boards through Game, which only hashes positions of up to four players
+    scoring.check_equivalence(n_bonus_panels=2000)
+
+def test_many_broadcasts():  # The *_many functions keep the shape of their inputs, as evaluation uses them on (positions, players) arrays
+    import numpy as np
+    rgen = random.Random(0)
+    masks = np.array([[rgen.getrandbits(scoring.ROWS*scoring.COLS) | 1 << (row*scoring.COLS+row) for row in range(scoring.ROWS)] for _ in range(3)])
+    rows = np.arange(scoring.ROWS)
+    assert scoring.score_tiles_many(masks, rows, rows).tolist() == [[scoring.score_tile(int(mask), row, row) for row, mask in enumerate(line)] for line in masks]
+    assert scoring.score_bonuses_many(masks).tolist() == [[scoring.score_bonuses(int(mask)) for mask in line] for line in masks]
+    colors = [[scoring.BASIC_COLOR_MASKS[::-1] for _ in line] for line in masks]
+    assert scoring.score_bonuses_many(masks, colors).tolist() == [[scoring.score_bonuses(int(mask), scoring.BASIC_COLOR_MASKS[::-1]) for mask in line] for line in masks]
+    assert scoring.score_bonuses_many([]).shape == (0,)
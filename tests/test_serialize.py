@@ -0,0 +1,70 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactState
+from simulation import serialize
+import random
+import json
+import copy
+import pytest
+
+def _states(n_players, seed=0):  # (name, state) at the start, mid-round, just before and after each round ends, and at the end of a seeded game
+    g = Game.new_game(n_players, False, random_seed=seed)
+    rgen = random.Random(seed)
+    states = [("start", g.state)]
+    ply = 0
+    while g.turn >= 0:
+        before = g.state
+        tiles = g.tiles_on_table
+        g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        ply += 1
+        if g.turn < 0 or g.tiles_on_table > tiles: states += [(f"ply {ply} round end", before), (f"ply {ply} next round", g.state)]
+        elif ply % 7 == 0: states.append((f"ply {ply} mid-round", g.state))
+    states.append(("game over", g.state))
+    return states
+
+def _cases():
+    for n_players in (2, 3, 4):
+        for name, state in _states(n_players):
+            yield pytest.param(state, id=f"{n_players}p {name}")
+            yield pytest.param(state.visible(), id=f"{n_players}p {name} view")
+    state = Game.new_game(2, False, random_seed=1).state
+    rgen = random.Random(1)
+    rgen.gauss(0, 1)  # Leaves a cached gauss value in the random state
+    state.random_state = rgen.getstate()
+    yield pytest.param(state, id="gauss")
+
+CASES = list(_cases())
+
+@pytest.mark.parametrize("state", CASES)
+def test_json_round_trip(state):
+    assert serialize.from_dict(serialize.to_dict(state)) == state
+    assert serialize.from_json(serialize.to_json(state)) == state
+
+@pytest.mark.parametrize("state", CASES)
+def test_bytes_round_trip(state):
+    data = serialize.to_bytes(state)
+    assert serialize.from_bytes(data) == state
+    compact = serialize.from_bytes(data, compact=True)
+    assert compact == CompactState.from_state(state)
+    assert serialize.to_bytes(compact) == data
+
+def test_bad_versions_are_rejected():
+    state = Game.new_game(2, False, random_seed=0).state
+    d = serialize.to_dict(state)
+    d["schema"] = serialize.SCHEMA+1
+    with pytest.raises(ValueError): serialize.from_dict(d)
+    del d["schema"]
+    with pytest.raises(ValueError): serialize.from_dict(d)
+    data = bytearray(serialize.to_bytes(state))
+    data[0] = serialize.FORMAT+1
+    with pytest.raises(ValueError): serialize.from_bytes(bytes(data))
+
+def test_patch_undoes_diff():  # patch(old, diff(old, new)) == new between any two of a game's states, views and line lists, and across player counts
+    docs = [serialize.to_dict(state) for n_players in (2, 3, 4) for _, state in _states(n_players)[::3]]
+    docs += [serialize.to_dict(Game.new_game(2, False, random_seed=0).view), ["a", "b"], ["a", "c", "d"], {}, 1]
+    rgen = random.Random(0)
+    pairs = list(zip(docs, docs[1:]))+[tuple(rgen.sample(docs, 2)) for _ in range(200)]
+    for old, new in pairs:
+        ops = serialize.diff(old, new)
+        assert serialize.patch(copy.deepcopy(old), ops) == new
+        assert json.loads(json.dumps(ops)) == ops  # Ops go to clients as JSON
+    assert serialize.diff(docs[0], copy.deepcopy(docs[0])) == []
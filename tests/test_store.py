@@ -0,0 +1,19 @@
+from backend.store import SQLiteStore, WriteBehind, StoredGame
+from simulation.movelog import MoveLog
+import time
+
+RECORD = StoredGame(MoveLog(2, False, 1), {1: "greedy"}, {0: "token"})
+
+def test_retention(tmp_path):  # The writer forgets games once they have gone retention seconds without a save
+    store = WriteBehind(SQLiteStore(str(tmp_path/"games.sqlite3")), interval=0.01, retention=0.2, sweep_every=0.01)
+    try:
+        store.save("old", RECORD)
+        store.flush()
+        time.sleep(0.3)
+        store.save("new", RECORD)
+        deadline = time.monotonic()+5
+        while store.store.load("old") is not None and time.monotonic() < deadline: time.sleep(0.01)
+        assert store.load("old") is None
+        assert store.load("new") == RECORD
+    finally:
+        store.close()
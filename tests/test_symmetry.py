@@ -0,0 +1,58 @@
+from simulation.game import Game, decode_move
+from simulation.compact import CompactGame, SLOTS
+from simulation.symmetry import batch_counts, canonicalize, canonical_form, canonical_hash, to_canonical, to_original, distinct_moves
+from array import array
+import random
+import pytest
+
+def _positions(engine):  # Seeded 4 player positions partway into the first round, when batches are most varied
+    for seed in range(12):
+        g = engine.new_game(4, False, random_seed=seed)
+        rgen = random.Random(seed)
+        for _ in range(rgen.randrange(10)): g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+        yield g, rgen
+
+def _shuffled(engine, state, rgen):  # A copy of state with its batches in a random order
+    state = state.copy()
+    if engine is Game:
+        rgen.shuffle(state.batches)
+    else:
+        batches = [state.batches[i:i+SLOTS] for i in range(0, len(state.batches), SLOTS)]
+        rgen.shuffle(batches)
+        state.batches = array(state.batches.typecode, [n for batch in batches for n in batch])
+    return state
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_canonical_hash(engine):  # Every batch order has the same canonical hash, which is the full hash of the canonicalized position
+    for g, rgen in _positions(engine):
+        state, order = canonicalize(g._state)
+        assert batch_counts(state) == sorted(batch_counts(g._state))
+        assert canonical_form(g) == (canonical_hash(g), order)
+        assert canonical_hash(g) == engine(state).position_hash == canonical_hash(engine(state))
+        for _ in range(3): assert canonical_hash(engine(_shuffled(engine, g._state, rgen))) == canonical_hash(g)
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_move_numbering_round_trip(engine):  # Moves map to the same move in the canonical position and back, and lead to canonically equal positions
+    for g, rgen in _positions(engine):
+        state, order = canonicalize(g._state)
+        canonical = engine(state)
+        codes = g.legal_moves()
+        assert sorted(to_canonical(code, order) for code in codes) == canonical.legal_moves()
+        for code in codes:
+            assert to_original(to_canonical(code, order), order) == code
+            child, canonical_child = engine(g.state), engine(canonical.state)
+            child.play(decode_move(code, g.turn))
+            canonical_child.play(decode_move(to_canonical(code, order), g.turn))
+            assert canonical_hash(child) == canonical_hash(canonical_child)
+
+@pytest.mark.parametrize("engine", [Game, CompactGame])
+def test_distinct_moves(engine):  # Dropped moves come from batches identical to one whose moves are kept, so they lead to canonically equal positions
+    for g, _ in _positions(engine):
+        codes = g.legal_moves()
+        kept = distinct_moves(g._state, codes)
+        hashes = set()
+        for code in codes:
+            child = engine(g.state)
+            child.play(decode_move(code, g.turn))
+            if code in kept: hashes.add(canonical_hash(child))
+            else: assert canonical_hash(child) in hashes
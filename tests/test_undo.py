@@ -0,0 +1,53 @@
+from simulation.game import Game, IllegalGameOperationError, decode_move
+from simulation.compact import CompactGame
+import random
+import pytest
+
+ENGINES = [Game, CompactGame]
+
+def _play_out(g, seed):  # Plays random moves to the end; returns the states before each move and the moves
+    rgen = random.Random(seed)
+    states, moves = [], []
+    while g.turn >= 0:
+        states.append((g.state, g.position_hash, g.tiles_on_table))
+        move = decode_move(rgen.choice(g.legal_moves()), g.turn)
+        moves.append(move)
+        g.play(move)
+    return states, moves
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_no_undo_by_default(engine):
+    g = engine.new_game(2, False, random_seed=1)
+    _play_out(g, 1)
+    assert len(g._undo_stack) == 0
+    with pytest.raises(IllegalGameOperationError): g.unplay()
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unplay(engine):  # Taking back every move of a whole game, round ends included, passes back through every earlier position
+    g = engine.new_game(3, False, random_seed=2, record_undo=True)
+    states, _ = _play_out(g, 2)
+    for state, position_hash, tiles_on_table in reversed(states):
+        g.unplay()
+        assert (g.state, g.position_hash, g.tiles_on_table) == (state, position_hash, tiles_on_table)
+        g._check_counters()
+    with pytest.raises(IllegalGameOperationError): g.unplay()
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_snapshot_and_restore(engine):  # A snapshot can be returned to any number of times, and the game plays on from it as it did the first time, draws included
+    g = engine.new_game(2, False, random_seed=3, record_undo=True)
+    rgen = random.Random(3)
+    for _ in range(7): g.play(decode_move(rgen.choice(g.legal_moves()), g.turn))
+    snapshot = g.snapshot()
+    before = g.state
+    states, moves = _play_out(g, 3)
+    end = g.state
+    for _ in range(2):
+        g.restore(snapshot)
+        assert g.state == before
+        for (state, position_hash, _), move in zip(states, moves):
+            assert (g.state, g.position_hash) == (state, position_hash)
+            g.play(move)
+        assert g.state == end
+    g.restore(snapshot)
+    g.unplay()  # The undo history comes back with the snapshot
+    g._check_counters()